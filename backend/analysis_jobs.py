@@ -0,0 +1,259 @@
+"""
+Asynchronous Analysis Jobs
+Uploads are saved and queued, background workers call the ML service, and the
+result is stored on the analysis record and pushed to the user over WebSocket
+"""
+
+import os
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import httpx
+from dotenv import load_dotenv
+
+from database import get_analysis_collection
+from ml_client import post_prediction
+from upload_stream import MultipartFile
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Concurrent ML calls, and jobs allowed to wait before uploads are refused
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "4"))
+ANALYSIS_QUEUE_SIZE = int(os.getenv("ANALYSIS_QUEUE_SIZE", "256"))
+
+# Extra attempts when the ML service is busy or unreachable
+ANALYSIS_JOB_RETRIES = int(os.getenv("ANALYSIS_JOB_RETRIES", "2"))
+
+# Job lifecycle, stored in job_status (status keeps the normal/warning/critical verdict)
+JOB_QUEUED = "queued"
+JOB_PROCESSING = "processing"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+# Shown when the ML service could not produce a result
+FALLBACK_ANALYSIS = {
+    "status": "warning",
+    "message": "Analysis completed with limited data. ML service unavailable.",
+    "details": [
+        "Unable to perform full ML analysis",
+        "Basic audio file received successfully",
+        "Please try again or consult a doctor for accurate diagnosis"
+    ],
+}
+
+# Shown when the ML service refused the recording itself (silent, too long, not audio)
+REJECTED_ANALYSIS = {
+    "status": "warning",
+    "message": "The recording could not be analyzed. Please record again.",
+    "details": [
+        "The analysis service could not use this recording",
+        "Record clear breathing for a few seconds in a quiet place"
+    ],
+}
+
+
+class QueueFullError(Exception):
+    """No room for another job"""
+
+
+class PermanentJobError(Exception):
+    """The ML service rejected the recording; retrying will not help"""
+
+
+def summarize_prediction(ml_result: Dict[str, Any]) -> Dict[str, Any]:
+    """Map an ML service prediction to the analysis status, message and details"""
+    confidence = ml_result.get("confidence", 0)
+    disease = ml_result.get("disease", "Unknown")
+    predictions = ml_result.get("predictions", {})
+
+    # Determine status based on confidence and disease
+    if disease.lower() in ["healthy", "normal"] or confidence < 0.3:
+        status = "normal"
+        message = "Your breathing patterns appear normal"
+    elif confidence < 0.6:
+        status = "warning"
+        message = f"Possible signs of {disease} detected. Consider consulting a doctor."
+    else:
+        status = "critical"
+        message = f"Strong indicators of {disease} detected. Please consult a doctor."
+
+    # Create detailed analysis from ML predictions
+    details = [
+        f"Detected condition: {disease}",
+        f"Confidence level: {confidence*100:.1f}%",
+    ]
+    # Add top predictions
+    sorted_predictions = sorted(predictions.items(), key=lambda x: x[1], reverse=True)[:3]
+    for condition, prob in sorted_predictions:
+        details.append(f"{condition}: {prob*100:.1f}%")
+
+    return {
+        "status": status,
+        "message": message,
+        "details": details,
+        "disease_type": disease,
+        "confidence": confidence,
+        "ml_result": ml_result,
+    }
+
+
+def job_view(analysis: Dict[str, Any]) -> Dict[str, Any]:
+    """Public fields of a job's analysis record, for polling and push messages"""
+    view = {
+        "job_id": analysis["id"],
+        "job_status": analysis.get("job_status", JOB_COMPLETED),
+        "created_at": analysis.get("created_at", ""),
+        "completed_at": analysis.get("completed_at"),
+    }
+    if view["job_status"] in (JOB_COMPLETED, JOB_FAILED):
+        view.update({
+            "status": analysis.get("status"),
+            "message": analysis.get("message", ""),
+            "details": analysis.get("details", []),
+            "disease_type": analysis.get("disease_type"),
+            "confidence": analysis.get("confidence"),
+            "result": analysis.get("ml_result"),
+        })
+    if analysis.get("job_error"):
+        view["error"] = analysis["job_error"]
+    return view
+
+
+def _retry_delay(response: Optional[httpx.Response], attempt: int) -> float:
+    """Honour the ML service's Retry-After, otherwise back off exponentially"""
+    if response is not None:
+        try:
+            return min(30.0, float(response.headers.get("Retry-After", "")))
+        except ValueError:
+            pass
+    return min(30.0, 2.0 ** attempt)
+
+
+class AnalysisJobQueue:
+    """
+    Bounded in-process queue of analysis jobs. The analysis record is the
+    source of truth; the queue only holds ids, so unfinished jobs are picked
+    up again after a restart.
+    """
+    def __init__(self, workers: int = ANALYSIS_WORKERS, max_size: int = ANALYSIS_QUEUE_SIZE):
+        self.workers = max(1, workers)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+        self.tasks = []
+        self.notify: Optional[Callable[[dict, str], Awaitable[Any]]] = None
+
+    async def start(self, notify: Optional[Callable[[dict, str], Awaitable[Any]]] = None):
+        """Start the workers and requeue jobs left unfinished by the last run"""
+        self.notify = notify
+        # Jobs that were running when the last process stopped start over.
+        # Done before any worker can claim a new job.
+        await get_analysis_collection().update_many(
+            {"job_status": JOB_PROCESSING}, {"$set": {"job_status": JOB_QUEUED}}
+        )
+        self.tasks = [asyncio.create_task(self._worker(index)) for index in range(self.workers)]
+        self.tasks.append(asyncio.create_task(self._recover()))
+        logger.info(f"Analysis job queue started ({self.workers} workers)")
+
+    async def stop(self):
+        """Stop the workers; queued jobs stay queued in the database"""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        logger.info("Analysis job queue stopped")
+
+    def check_capacity(self):
+        if self.queue.full():
+            raise QueueFullError(f"{self.queue.qsize()} analysis jobs already waiting")
+
+    def submit(self, job_id: str):
+        try:
+            self.queue.put_nowait(job_id)
+        except asyncio.QueueFull:
+            raise QueueFullError(f"{self.queue.qsize()} analysis jobs already waiting")
+
+    async def _recover(self):
+        collection = get_analysis_collection()
+        cursor = collection.find({"job_status": JOB_QUEUED}, {"id": 1}).sort("created_at", 1)
+        recovered = 0
+        async for analysis in cursor:
+            # Waits for room rather than refusing, unlike new uploads
+            await self.queue.put(analysis["id"])
+            recovered += 1
+        if recovered:
+            logger.info(f"Requeued {recovered} unfinished analysis jobs")
+
+    async def _worker(self, index: int):
+        while True:
+            job_id = await self.queue.get()
+            try:
+                await self.process(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Analysis job {job_id} crashed in worker {index}: {str(e)}")
+            finally:
+                self.queue.task_done()
+
+    async def process(self, job_id: str):
+        collection = get_analysis_collection()
+        # Claim the job, so one queued twice (new upload seen by recovery too) only runs once
+        analysis = await collection.find_one_and_update(
+            {"id": job_id, "job_status": JOB_QUEUED},
+            {"$set": {"job_status": JOB_PROCESSING, "started_at": datetime.utcnow().isoformat()}},
+        )
+        if analysis is None:
+            return
+
+        try:
+            ml_result = await self._predict(analysis["file_path"])
+            update = {**summarize_prediction(ml_result), "job_status": JOB_COMPLETED}
+        except PermanentJobError as e:
+            logger.warning(f"Analysis job {job_id} rejected: {str(e)}")
+            update = {**REJECTED_ANALYSIS, "job_status": JOB_FAILED, "job_error": str(e)}
+        except Exception as e:
+            logger.error(f"Analysis job {job_id} failed: {str(e)}")
+            update = {**FALLBACK_ANALYSIS, "job_status": JOB_FAILED, "job_error": str(e)}
+        update["completed_at"] = datetime.utcnow().isoformat()
+
+        await collection.update_one({"id": job_id}, {"$set": update})
+        analysis.update(update)
+
+        if self.notify is not None:
+            message = {"type": "analysis_job", **job_view(analysis)}
+            await self.notify(message, analysis["user_id"])
+
+    async def _predict(self, file_path: str) -> Dict[str, Any]:
+        """Stream the recording to the ML service, retrying while it is busy or unreachable"""
+        if not os.path.exists(file_path):
+            raise PermanentJobError(f"Recording {file_path} is missing")
+        upload = MultipartFile(file_path, "audio_file", os.path.basename(file_path), "audio/wav")
+
+        for attempt in range(ANALYSIS_JOB_RETRIES + 1):
+            response = None
+            try:
+                response = await post_prediction(upload)
+                if response.status_code == 200:
+                    return response.json()
+                if response.status_code < 500:
+                    raise PermanentJobError(f"ML service returned status {response.status_code}: {response.text}")
+                error = f"ML service returned status {response.status_code}"
+            except httpx.TimeoutException:
+                error = "ML service timeout"
+            except httpx.RequestError as e:
+                error = f"ML service unavailable: {str(e)}"
+
+            if attempt < ANALYSIS_JOB_RETRIES:
+                delay = _retry_delay(response, attempt)
+                logger.warning(f"{error}; retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+        raise Exception(error)
+
+
+# Create global job queue instance
+analysis_jobs = AnalysisJobQueue()
@@ -0,0 +1,100 @@
+"""
+Analysis Reuse
+A user re-uploading a recording (typically a mobile client retrying after a
+timeout) is answered from the earlier analysis instead of calling the ML
+service again: matched by content hash and model fingerprint within a recent
+window, or by the client's Idempotency-Key. Identical requests that arrive
+while the first is still running share its ML call.
+"""
+import os
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from database import get_analysis_collection
+from ml_client import served_fingerprint
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Seconds an analysis may be reused for an identical recording from the same
+# user (0 disables hash matching; an Idempotency-Key is still honoured)
+ANALYSIS_REUSE_WINDOW = float(os.getenv("ANALYSIS_REUSE_WINDOW", "3600"))
+
+class IdempotencyKeyConflict(Exception):
+    """The Idempotency-Key was already used with a different recording"""
+    pass
+
+async def find_reusable(user_id: str, sha256: str, idempotency_key: Optional[str] = None) -> Optional[Dict]:
+    """
+    An earlier analysis that answers this request: the one recorded under the
+    same Idempotency-Key, otherwise the latest one of the same recording by
+    the model every ML replica currently serves. Matching on the fingerprint
+    rather than the version name catches a name reloaded with another file.
+    """
+    analysis_collection = get_analysis_collection()
+
+    if idempotency_key:
+        analysis = await analysis_collection.find_one({"user_id": user_id, "idempotency_keys": idempotency_key})
+        if analysis is not None:
+            if analysis.get("content_sha256") != sha256:
+                raise IdempotencyKeyConflict(idempotency_key)
+            return analysis
+
+    # Unknown until health checks (or predictions) have reached every replica
+    fingerprint = served_fingerprint()
+    if ANALYSIS_REUSE_WINDOW <= 0 or fingerprint is None:
+        return None
+
+    matches = await analysis_collection.find({
+        "user_id": user_id,
+        "content_sha256": sha256,
+        "model_fingerprint": fingerprint,
+        "timestamp": {"$gte": datetime.utcnow() - timedelta(seconds=ANALYSIS_REUSE_WINDOW)}
+    }).sort("timestamp", -1).to_list(length=1)
+    return matches[0] if matches else None
+
+async def attach(analysis: Dict, idempotency_key: Optional[str] = None):
+    """Record a repeated request against the analysis that answered it"""
+    update = {"$inc": {"reuse_count": 1}, "$set": {"last_reused_at": datetime.utcnow()}}
+    if idempotency_key:
+        update["$addToSet"] = {"idempotency_keys": idempotency_key}
+    await get_analysis_collection().update_one({"_id": analysis["_id"]}, update)
+    logger.info(f"Reused analysis {analysis['_id']} for user {analysis['user_id']}")
+
+class InFlightAnalyses:
+    """
+    Analyses currently running, by (user id, content hash). The work runs as
+    its own task, so it finishes and is stored even if the request that
+    started it goes away; the client's retry then finds it.
+    """
+    def __init__(self):
+        self.pending: Dict[Tuple[str, str], asyncio.Task] = {}
+
+    def running(self, key: Tuple[str, str]) -> bool:
+        return key in self.pending
+
+    async def run(self, key: Tuple[str, str], work: Callable[[], Awaitable]) -> Tuple[object, bool]:
+        """Result of work(), or of the identical analysis already running; and whether it was shared"""
+        task = self.pending.get(key)
+        shared = task is not None
+        if not shared:
+            task = asyncio.create_task(work())
+            self.pending[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        return await asyncio.shield(task), shared
+
+    def _finished(self, key: Tuple[str, str], task: asyncio.Task):
+        if self.pending.get(key) is task:
+            del self.pending[key]
+        # Nobody may be left waiting for the outcome
+        if not task.cancelled():
+            task.exception()
+
+# Create global in-flight registry
+inflight_analyses = InFlightAnalyses()
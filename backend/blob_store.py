@@ -0,0 +1,145 @@
+"""
+Content-Addressed Blob Store
+Recordings and avatars are stored once per SHA-256, under sharded directories
+(ab/cd/abcd...wav). Documents that point at a blob hold a reference on it in
+the `blobs` collection; the bytes are deleted when the last reference goes.
+"""
+import os
+import re
+import asyncio
+import logging
+import weakref
+from datetime import datetime
+from typing import Dict, Optional
+
+import aiofiles.os
+from dotenv import load_dotenv
+from pymongo import ReturnDocument
+
+from database import get_blobs_collection
+from upload_stream import StoredUpload
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Storage backend and, for the local backend, the root directory (relative
+# paths resolve against the backend's working directory, like file_path)
+BLOB_STORE_BACKEND = os.getenv("BLOB_STORE_BACKEND", "local")
+BLOB_STORE_ROOT = os.getenv("BLOB_STORE_ROOT", "uploads/blobs")
+
+def file_suffix(filename: Optional[str]) -> str:
+    """Lower-case extension kept on stored files, so tools that go by extension still work"""
+    suffix = os.path.splitext(filename or "")[1].lower()
+    return suffix if re.fullmatch(r"\.[a-z0-9]{1,5}", suffix) else ""
+
+class LocalBlobBackend:
+    """
+    Blobs as files on local disk. Other backends (e.g. an S3-compatible store)
+    implement the same four methods; local_path() is where they would fetch a
+    copy for code that needs a file.
+    """
+    def __init__(self, root: str = BLOB_STORE_ROOT):
+        self.root = root
+
+    def location(self, sha256: str, suffix: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256 + suffix)
+
+    async def store(self, source_path: str, location: str):
+        """Move a finished upload into place; identical content may already be there"""
+        if await aiofiles.os.path.exists(location):
+            await aiofiles.os.remove(source_path)
+            return
+        await aiofiles.os.makedirs(os.path.dirname(location), exist_ok=True)
+        await aiofiles.os.replace(source_path, location)
+
+    async def delete(self, location: str):
+        if await aiofiles.os.path.exists(location):
+            await aiofiles.os.remove(location)
+
+    async def local_path(self, location: str) -> str:
+        return location
+
+BACKENDS = {"local": LocalBlobBackend}
+
+class BlobStore:
+    def __init__(self, backend):
+        self.backend = backend
+        # One lock per hash while it is in use, so a put cannot dedupe into a
+        # file that a release of the last reference is about to delete
+        self.locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    def lock(self, sha256: str) -> asyncio.Lock:
+        lock = self.locks.get(sha256)
+        if lock is None:
+            lock = self.locks[sha256] = asyncio.Lock()
+        return lock
+
+    async def put(self, upload: StoredUpload) -> Dict:
+        """
+        Store a saved upload under its hash and take a reference on it. A copy
+        that is already stored is kept and the new file discarded. Afterwards
+        upload.path points at the stored copy; if storing fails, the saved
+        upload is removed.
+        """
+        blobs_collection = get_blobs_collection()
+        location = self.backend.location(upload.sha256, file_suffix(upload.filename))
+        try:
+            async with self.lock(upload.sha256):
+                blob = await blobs_collection.find_one_and_update(
+                    {"_id": upload.sha256},
+                    {
+                        "$inc": {"refcount": 1},
+                        "$setOnInsert": {
+                            "location": location,
+                            "size": upload.size,
+                            "content_type": upload.content_type,
+                            "backend": BLOB_STORE_BACKEND,
+                            "created_at": datetime.utcnow().isoformat()
+                        }
+                    },
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+                try:
+                    await self.backend.store(upload.path, blob["location"])
+                except Exception:
+                    await self._release(upload.sha256)
+                    raise
+        finally:
+            # store() moves or removes the saved upload; anything left means it never ran
+            if await aiofiles.os.path.exists(upload.path):
+                await aiofiles.os.remove(upload.path)
+        upload.path = await self.backend.local_path(blob["location"])
+        if blob["refcount"] > 1:
+            logger.info(f"Deduplicated upload {upload.filename} ({upload.size} bytes) into blob {upload.sha256[:12]}")
+        return blob
+
+    async def release(self, sha256: Optional[str]):
+        """Drop one reference; the last one deletes the blob"""
+        if not sha256:
+            return
+        async with self.lock(sha256):
+            await self._release(sha256)
+
+    async def _release(self, sha256: str):
+        blobs_collection = get_blobs_collection()
+        blob = await blobs_collection.find_one_and_update(
+            {"_id": sha256, "refcount": {"$gt": 0}},
+            {"$inc": {"refcount": -1}},
+            return_document=ReturnDocument.AFTER
+        )
+        if blob is None or blob["refcount"] > 0:
+            return
+        # Only the release that removed the record deletes the file; a put that
+        # took a new reference in the meantime keeps both
+        result = await blobs_collection.delete_one({"_id": sha256, "refcount": 0})
+        if result.deleted_count == 1:
+            await self.backend.delete(blob["location"])
+
+    async def local_path(self, blob: Dict) -> str:
+        return await self.backend.local_path(blob["location"])
+
+# Create global blob store instance
+blob_store = BlobStore(BACKENDS[BLOB_STORE_BACKEND]())
@@ -61,3 +61,6 @@ def get_notifications_collection():
 
 def get_feedback_collection():
     return database.db.feedback
+
+def get_blobs_collection():
+    return database.db.blobs
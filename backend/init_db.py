@@ -65,6 +65,13 @@ def init_database():
     collections['analysis'].create_index([("user_id", ASCENDING)])
     collections['analysis'].create_index([("created_at", DESCENDING)])
     collections['analysis'].create_index([("status", ASCENDING)])
+    collections['analysis'].create_index([
+        ("user_id", ASCENDING),
+        ("content_sha256", ASCENDING),
+        ("model_fingerprint", ASCENDING),
+        ("timestamp", DESCENDING)
+    ])
+    collections['analysis'].create_index([("user_id", ASCENDING), ("idempotency_keys", ASCENDING)])
 
     # Create indexes for chat_messages collection
     collections['chat_messages'].create_index([("id", ASCENDING)], unique=True)
@@ -1,4 +1,4 @@
-from fastapi import FastAPI, HTTPException, Depends, status, File, UploadFile, Form, BackgroundTasks, WebSocket, Request
+from fastapi import FastAPI, HTTPException, Depends, status, File, UploadFile, Form, BackgroundTasks, WebSocket, Request, Header
 from fastapi.websockets import WebSocketDisconnect
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
@@ -43,6 +43,18 @@ from email_service import (
     send_appointment_cancellation
 )
 from appointment_scheduler import scheduler
+from upload_stream import save_upload
+from blob_store import blob_store
+from ml_client import connect_ml_client, close_ml_client, describe_replicas, post_prediction
+from analysis_reuse import IdempotencyKeyConflict, attach, find_reusable, inflight_analyses
+from analysis_jobs import (
+    FALLBACK_ANALYSIS,
+    JOB_QUEUED,
+    QueueFullError,
+    analysis_jobs,
+    job_view,
+    summarize_prediction
+)
 
 # Load environment variables
 load_dotenv()
@@ -90,13 +102,18 @@ app.add_middleware(
 @app.on_event("startup")
 async def startup_db_client():
     await connect_to_mongo()
+    await connect_ml_client()
     # Start appointment reminder scheduler
     await scheduler.start()
+    # Start analysis job workers; results are pushed to connected users
+    await analysis_jobs.start(push_analysis_update)
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
     # Stop appointment reminder scheduler
     await scheduler.stop()
+    await analysis_jobs.stop()
+    await close_ml_client()
     await close_mongo_connection()
 
 # =============================================
@@ -401,26 +418,14 @@ class AdminDoctorCreate(BaseModel):
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
 MAX_AUDIO_FILE_SIZE = 20 * 1024 * 1024  # 20MB
 
-async def validate_file_size(file: UploadFile, max_size: int = MAX_FILE_SIZE):
-    """Validate file size without reading entire file into memory"""
-    # Read file in chunks to check size
-    file_size = 0
-    chunk_size = 1024 * 1024  # 1MB chunks
-
-    # Reset file pointer
-    await file.seek(0)
+# Uploads land here before they are moved into the blob store
+UPLOAD_TMP_DIR = "uploads/tmp"
 
-    while chunk := await file.read(chunk_size):
-        file_size += len(chunk)
-        if file_size > max_size:
-            raise HTTPException(
-                status_code=413,
-                detail=f"File too large. Maximum size is {max_size / (1024*1024):.0f}MB"
-            )
-
-    # Reset file pointer for actual processing
-    await file.seek(0)
-    return file_size
+async def spool_upload(file: UploadFile, max_size: int):
+    """Stream an upload to a temporary file (see upload_stream.save_upload)"""
+    os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+    temp_path = os.path.join(UPLOAD_TMP_DIR, f"{uuid.uuid4()}_{os.path.basename(file.filename or 'upload')}")
+    return await save_upload(file, temp_path, max_size)
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -908,38 +913,34 @@ async def upload_avatar(
             detail="Invalid file type. Only JPG and PNG images are allowed."
         )
 
-    # Validate file size (5MB max)
+    # 5MB max, enforced while the file is saved
     MAX_AVATAR_SIZE = 5 * 1024 * 1024  # 5MB
-    await validate_file_size(avatar, MAX_AVATAR_SIZE)
-
-    # Create avatars directory if it doesn't exist
-    avatars_dir = "uploads/avatars"
-    os.makedirs(avatars_dir, exist_ok=True)
-
-    # Generate unique filename
-    file_extension = avatar.filename.split(".")[-1]
-    filename = f"{current_user['id']}_{uuid.uuid4()}.{file_extension}"
-    file_path = os.path.join(avatars_dir, filename)
 
-    # Save file
-    await avatar.seek(0)
-    with open(file_path, "wb") as buffer:
-        content = await avatar.read()
-        buffer.write(content)
+    # Save file into the blob store (identical images are stored once)
+    upload = await spool_upload(avatar, MAX_AVATAR_SIZE)
+    blob = await blob_store.put(upload)
 
     # Update user's avatar_url in database
-    avatar_url = f"/{file_path}"
+    avatar_url = f"/{blob['location']}"
     await users_collection.update_one(
         {"id": current_user["id"]},
-        {"$set": {"avatar_url": avatar_url}}
+        {"$set": {"avatar_url": avatar_url, "avatar_sha256": upload.sha256}}
     )
 
+    # The user no longer references the previous avatar
+    await blob_store.release(current_user.get("avatar_sha256"))
+
     return {"avatar_url": avatar_url, "message": "Avatar uploaded successfully"}
 
 # =============================================
 # ADMIN ENDPOINTS
 # =============================================
 
+@app.get("/admin/ml-replicas")
+async def get_ml_replicas(current_user = Depends(check_admin_role)):
+    """Health, circuit breaker state and load of each ML service replica"""
+    return describe_replicas()
+
 @app.get("/admin/stats")
 async def get_admin_stats(current_user = Depends(check_admin_role)):
     """Get admin dashboard statistics"""
@@ -1713,71 +1714,29 @@ async def upload_analysis(
 ):
     analysis_collection = get_analysis_collection()
 
-    # Validate file size
-    await validate_file_size(file, MAX_FILE_SIZE)
-
-    # Save file to disk (in a real app, you would use cloud storage)
-    file_path = f"uploads/{current_user['id']}_{file.filename}"
-    os.makedirs("uploads", exist_ok=True)
-
-    with open(file_path, "wb") as buffer:
-        content = await file.read()
-        buffer.write(content)
-
-    # Call the ML model for actual analysis
-    ML_SERVICE_URL = os.getenv("ML_SERVICE_URL", "http://localhost:8001/predict")
+    # Save file in one streaming pass, enforcing the size limit, then store it
+    # by content hash so repeated recordings take disk space once
+    upload = await spool_upload(file, MAX_FILE_SIZE)
+    blob = await blob_store.put(upload)
+    file_path = blob["location"]
 
     try:
-        # Send file to ML service for prediction
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            with open(file_path, "rb") as audio_file:
-                files = {'audio_file': (file.filename, audio_file, 'audio/wav')}
-                response = await client.post(ML_SERVICE_URL, files=files)
-
-            if response.status_code == 200:
-                ml_result = response.json()
-
-                # Map ML result to analysis status
-                confidence = ml_result.get("confidence", 0)
-                disease = ml_result.get("disease", "Unknown")
-                predictions = ml_result.get("predictions", {})
-
-                # Determine status based on confidence and disease
-                if disease.lower() in ["healthy", "normal"] or confidence < 0.3:
-                    status = "normal"
-                    message = "Your breathing patterns appear normal"
-                elif confidence < 0.6:
-                    status = "warning"
-                    message = f"Possible signs of {disease} detected. Consider consulting a doctor."
-                else:
-                    status = "critical"
-                    message = f"Strong indicators of {disease} detected. Please consult a doctor."
-
-                # Create detailed analysis from ML predictions
-                details = [
-                    f"Detected condition: {disease}",
-                    f"Confidence level: {confidence*100:.1f}%",
-                ]
-                # Add top predictions
-                sorted_predictions = sorted(predictions.items(), key=lambda x: x[1], reverse=True)[:3]
-                for condition, prob in sorted_predictions:
-                    details.append(f"{condition}: {prob*100:.1f}%")
-
-                analysis_dict = {
-                    "id": str(uuid.uuid4()),
-                    "user_id": current_user["id"],
-                    "file_path": file_path,
-                    "analysis_type": "file",
-                    "status": status,
-                    "message": message,
-                    "details": details,
-                    "disease_type": disease,
-                    "confidence": confidence,
-                    "ml_result": ml_result,
-                    "created_at": datetime.utcnow().isoformat()
-                }
-            else:
-                raise Exception(f"ML service returned status {response.status_code}")
+        # Stream the saved file to the ML service for prediction
+        response = await post_prediction(upload.multipart())
+
+        if response.status_code == 200:
+            # Map ML result to analysis status, message and details
+            analysis_dict = {
+                "id": str(uuid.uuid4()),
+                "user_id": current_user["id"],
+                "file_path": file_path,
+                "content_sha256": upload.sha256,
+                "analysis_type": "file",
+                **summarize_prediction(response.json()),
+                "created_at": datetime.utcnow().isoformat()
+            }
+        else:
+            raise Exception(f"ML service returned status {response.status_code}")
 
     except Exception as e:
         print(f"ML service error: {str(e)}, using fallback analysis")
@@ -1786,14 +1745,9 @@ async def upload_analysis(
             "id": str(uuid.uuid4()),
             "user_id": current_user["id"],
             "file_path": file_path,
+            "content_sha256": upload.sha256,
             "analysis_type": "file",
-            "status": "warning",
-            "message": "Analysis completed with limited data. ML service unavailable.",
-            "details": [
-                "Unable to perform full ML analysis",
-                "Basic audio file received successfully",
-                "Please try again or consult a doctor for accurate diagnosis"
-            ],
+            **FALLBACK_ANALYSIS,
             "created_at": datetime.utcnow().isoformat()
         }
 
@@ -1866,52 +1820,140 @@ async def get_analysis(current_user = Depends(get_current_active_user)):
         ) for analysis in analyses
     ]
 
+def reused_analysis(analysis: dict):
+    return JSONResponse(content=analysis["result"], headers={"X-Analysis-Reused": "true"})
+
 @app.post("/api/analysis/lung-disease")
 async def analyze_lung_disease(
     audio_file: UploadFile = File(...),
+    idempotency_key: Optional[str] = Header(None),
     current_user: dict = Depends(get_current_user)
 ):
-    analysis_collection = get_analysis_collection()
+    # Spool to a temporary file in one streaming pass, enforcing the size limit
+    upload = await spool_upload(audio_file, MAX_AUDIO_FILE_SIZE)
+    key = (current_user["id"], upload.sha256)
+    # The file belongs to the analysis task once one is started for it
+    handed_over = False
 
-    # Validate audio file size
-    await validate_file_size(audio_file, MAX_AUDIO_FILE_SIZE)
-
-    # ML service URL from environment
-    ML_SERVICE_URL = os.getenv("ML_SERVICE_URL", "http://localhost:8001/predict")
+    try:
+        # A repeat of a recording already analysed is answered from the stored result
+        try:
+            previous = await find_reusable(current_user["id"], upload.sha256, idempotency_key)
+        except IdempotencyKeyConflict:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different recording")
+        if previous is not None:
+            await attach(previous, idempotency_key)
+            return reused_analysis(previous)
+
+        handed_over = not inflight_analyses.running(key)
+        analysis_data, shared = await inflight_analyses.run(
+            key, lambda: predict_lung_disease(upload, current_user["id"], idempotency_key)
+        )
+        if shared:
+            await attach(analysis_data, idempotency_key)
+            return reused_analysis(analysis_data)
+        return analysis_data["result"]
+    finally:
+        if not handed_over:
+            os.remove(upload.path)
+
+async def predict_lung_disease(upload, user_id: str, idempotency_key: Optional[str]) -> dict:
+    """Run the ML prediction for a spooled upload and store it; removes the upload when done"""
+    analysis_collection = get_analysis_collection()
 
     try:
-        # Reset file pointer before reading
-        await audio_file.seek(0)
-        file_content = await audio_file.read()
-
-        # Forward the request to ML service using async httpx
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            files = {'audio_file': (audio_file.filename, file_content, 'audio/wav')}
-            response = await client.post(ML_SERVICE_URL, files=files)
-
-            if response.status_code == 200:
-                result = response.json()
-
-                # Store analysis result in database
-                analysis_data = {
-                    "user_id": current_user["id"],
-                    "disease_type": result.get("disease"),
-                    "confidence": result.get("confidence"),
-                    "result": result,
-                    "timestamp": datetime.utcnow()
-                }
-                await analysis_collection.insert_one(analysis_data)
+        # Stream it to the least loaded healthy ML replica
+        response = await post_prediction(upload.multipart())
+
+        if response.status_code == 200:
+            result = response.json()
+
+            # Store analysis result in database
+            analysis_data = {
+                "user_id": user_id,
+                "disease_type": result.get("disease"),
+                "confidence": result.get("confidence"),
+                "content_sha256": upload.sha256,
+                "model_version": response.headers.get("X-Model-Version"),
+                "model_fingerprint": response.headers.get("X-Model-Fingerprint"),
+                "idempotency_keys": [idempotency_key] if idempotency_key else [],
+                "result": result,
+                "timestamp": datetime.utcnow()
+            }
+            await analysis_collection.insert_one(analysis_data)
 
-                return result
-            else:
-                raise HTTPException(
-                    status_code=500,
-                    detail=f"Prediction service error: {response.text}"
-                )
+            return analysis_data
+        else:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Prediction service error: {response.text}"
+            )
     except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="ML service timeout")
     except httpx.RequestError as e:
         raise HTTPException(status_code=503, detail=f"ML service unavailable: {str(e)}")
+    finally:
+        os.remove(upload.path)
+
+async def push_analysis_update(message: dict, user_id: str):
+    """Push a finished analysis job to its owner, if they have a WebSocket open"""
+    if user_id in ws_manager.active_connections:
+        await ws_manager.send_personal_message(message, user_id)
+
+@app.post("/analysis/jobs", status_code=202)
+async def submit_analysis_job(
+    file: UploadFile = File(...),
+    current_user = Depends(get_current_active_user)
+):
+    """
+    Queue a recording for analysis and return a job id straight away. The
+    result is stored on the analysis record; poll GET /analysis/jobs/{job_id}
+    or wait for the "analysis_job" WebSocket message.
+    """
+    analysis_collection = get_analysis_collection()
+
+    # Refuse before saving anything if the workers are too far behind
+    try:
+        analysis_jobs.check_capacity()
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=f"Analysis queue is full: {str(e)}", headers={"Retry-After": "30"})
+
+    # Saved in one streaming pass, enforcing the size limit, then stored by content hash
+    upload = await spool_upload(file, MAX_AUDIO_FILE_SIZE)
+    blob = await blob_store.put(upload)
+
+    job_id = str(uuid.uuid4())
+    analysis_dict = {
+        "id": job_id,
+        "user_id": current_user["id"],
+        "file_path": blob["location"],
+        "content_sha256": upload.sha256,
+        "analysis_type": "file",
+        "status": None,
+        "message": "Analysis in progress",
+        "details": [],
+        "job_status": JOB_QUEUED,
+        "created_at": datetime.utcnow().isoformat()
+    }
+    await analysis_collection.insert_one(analysis_dict)
+
+    try:
+        analysis_jobs.submit(job_id)
+    except QueueFullError as e:
+        await analysis_collection.delete_one({"id": job_id})
+        await blob_store.release(upload.sha256)
+        raise HTTPException(status_code=503, detail=f"Analysis queue is full: {str(e)}", headers={"Retry-After": "30"})
+
+    return {**job_view(analysis_dict), "poll_url": f"/analysis/jobs/{job_id}"}
+
+@app.get("/analysis/jobs/{job_id}")
+async def get_analysis_job(job_id: str, current_user = Depends(get_current_active_user)):
+    """Job status, plus the analysis once it has completed (or failed)"""
+    analysis_collection = get_analysis_collection()
+    analysis = await analysis_collection.find_one({"id": job_id})
+    if not analysis or (analysis["user_id"] != current_user["id"] and current_user["role"] != "admin"):
+        raise HTTPException(status_code=404, detail="Analysis job not found")
+    return job_view(analysis)
 
 # =============================================
 # NOTIFICATION ENDPOINTS
@@ -0,0 +1,297 @@
+"""
+Shared HTTP Client for the ML Service
+One pooled client for the application's lifetime, so calls reuse keep-alive
+connections instead of opening a new one per analysis. Predictions are spread
+over the ML replicas by least outstanding requests; replicas failing health
+checks or tripping the circuit breaker are ejected until they recover.
+"""
+import os
+import time
+import random
+import asyncio
+import logging
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+ML_SERVICE_URL = os.getenv("ML_SERVICE_URL", "http://localhost:8001/predict")
+
+# Comma-separated /predict URLs of every ML replica (default: ML_SERVICE_URL alone)
+ML_SERVICE_URLS = [
+    url.strip() for url in os.getenv("ML_SERVICE_URLS", ML_SERVICE_URL).split(",") if url.strip()
+]
+
+# Active health checks against each replica's readiness endpoint (interval 0 disables)
+ML_HEALTH_PATH = os.getenv("ML_HEALTH_PATH", "/ready")
+ML_HEALTH_INTERVAL = float(os.getenv("ML_HEALTH_INTERVAL", "5"))
+ML_HEALTH_TIMEOUT = float(os.getenv("ML_HEALTH_TIMEOUT", "2"))
+
+# Circuit breaker: consecutive failures (transport errors or BREAKER_STATUSES)
+# that eject a replica, and seconds before a single probe request may bring it back
+ML_BREAKER_FAILURES = int(os.getenv("ML_BREAKER_FAILURES", "3"))
+ML_BREAKER_COOLDOWN = float(os.getenv("ML_BREAKER_COOLDOWN", "10"))
+
+# Responses that mean the replica is broken. A 503 with Retry-After is the ML
+# service shedding load (admission control, or a model still warming up): the
+# request is retried elsewhere, but a busy replica is not ejected for it.
+BREAKER_STATUSES = (500, 502, 504)
+
+# Send a second copy of a prediction to another replica when the first has not
+# answered after this many milliseconds (0 disables hedging)
+ML_HEDGE_AFTER_MS = float(os.getenv("ML_HEDGE_AFTER_MS", "0"))
+
+# Connection pool: total connections, idle connections kept open, and how long
+# an idle connection is kept (seconds)
+ML_MAX_CONNECTIONS = int(os.getenv("ML_MAX_CONNECTIONS", "100"))
+ML_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("ML_MAX_KEEPALIVE_CONNECTIONS", "20"))
+ML_KEEPALIVE_EXPIRY = float(os.getenv("ML_KEEPALIVE_EXPIRY", "30"))
+
+# Per-phase timeouts (seconds). Pool is how long a request waits for a free connection.
+ML_CONNECT_TIMEOUT = float(os.getenv("ML_CONNECT_TIMEOUT", "5"))
+ML_READ_TIMEOUT = float(os.getenv("ML_READ_TIMEOUT", "60"))
+ML_WRITE_TIMEOUT = float(os.getenv("ML_WRITE_TIMEOUT", "30"))
+ML_POOL_TIMEOUT = float(os.getenv("ML_POOL_TIMEOUT", "10"))
+
+# Negotiated over TLS only (e.g. an HTTPS proxy in front of the ML service); needs the h2 package
+ML_HTTP2 = os.getenv("ML_HTTP2", "false").strip().lower() in ("1", "true", "yes")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class Replica:
+    """One ML service endpoint with its load, health and circuit breaker state"""
+    def __init__(self, url: str):
+        self.url = url
+        parts = urlsplit(url)
+        self.health_url = f"{parts.scheme}://{parts.netloc}{ML_HEALTH_PATH}"
+        self.outstanding = 0
+        self.healthy = True
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.latency = None
+        # Model serving this replica's default predictions, from its last health
+        # check or prediction (see the ML service's X-Model-Fingerprint)
+        self.model_version = None
+        self.fingerprint = None
+
+    def available(self, now: float) -> bool:
+        if not self.healthy:
+            return False
+        if self.state == OPEN:
+            if now - self.opened_at < ML_BREAKER_COOLDOWN:
+                return False
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            # One probe at a time
+            return self.outstanding == 0
+        return True
+
+    def record_success(self, elapsed: float):
+        self.failures = 0
+        self.latency = elapsed if self.latency is None else 0.8 * self.latency + 0.2 * elapsed
+        if self.state != CLOSED:
+            logger.info(f"ML replica {self.url} recovered")
+            self.state = CLOSED
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= ML_BREAKER_FAILURES):
+            logger.warning(f"ML replica {self.url} ejected after {self.failures} failures")
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def describe(self) -> Dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "circuit": self.state,
+            "outstanding": self.outstanding,
+            "consecutive_failures": self.failures,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "model_version": self.model_version,
+            "model_fingerprint": self.fingerprint,
+        }
+
+class MLClient:
+    client: httpx.AsyncClient = None
+    replicas: List[Replica] = []
+    health_task: Optional[asyncio.Task] = None
+
+# Create client instance
+ml_client = MLClient()
+
+def http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+async def connect_ml_client():
+    """Create the shared ML service client on startup"""
+    http2 = ML_HTTP2 and http2_available()
+    if ML_HTTP2 and not http2:
+        logger.warning("ML_HTTP2 is set but the h2 package is not installed; using HTTP/1.1")
+
+    ml_client.client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=ML_MAX_CONNECTIONS,
+            max_keepalive_connections=ML_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=ML_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            connect=ML_CONNECT_TIMEOUT,
+            read=ML_READ_TIMEOUT,
+            write=ML_WRITE_TIMEOUT,
+            pool=ML_POOL_TIMEOUT,
+        ),
+        http2=http2,
+    )
+    ml_client.replicas = [Replica(url) for url in ML_SERVICE_URLS]
+    if ML_HEALTH_INTERVAL > 0:
+        ml_client.health_task = asyncio.create_task(run_health_checks())
+    print(f"ML service client ready ({len(ml_client.replicas)} replicas, {ML_MAX_CONNECTIONS} connections, "
+          f"HTTP/{'2' if http2 else '1.1'})")
+
+async def close_ml_client():
+    """Close pooled connections on shutdown"""
+    if ml_client.health_task is not None:
+        ml_client.health_task.cancel()
+        ml_client.health_task = None
+    if ml_client.client is not None:
+        await ml_client.client.aclose()
+        ml_client.client = None
+    print("Closed ML service client")
+
+def get_ml_client() -> httpx.AsyncClient:
+    """Get the shared ML service client"""
+    return ml_client.client
+
+async def check_replica(replica: Replica):
+    try:
+        response = await ml_client.client.get(replica.health_url, timeout=ML_HEALTH_TIMEOUT)
+        healthy = response.status_code == 200
+        if healthy:
+            replica.fingerprint = response.json().get("model_fingerprint")
+    except (httpx.HTTPError, ValueError):
+        healthy = False
+    if healthy != replica.healthy:
+        logger.warning(f"ML replica {replica.url} is {'healthy' if healthy else 'unhealthy'}")
+    replica.healthy = healthy
+
+async def run_health_checks():
+    """Poll every replica's readiness endpoint in the background"""
+    while True:
+        await asyncio.gather(*[check_replica(replica) for replica in ml_client.replicas])
+        await asyncio.sleep(ML_HEALTH_INTERVAL)
+
+def choose_replica(exclude: List[Replica]) -> Optional[Replica]:
+    """Least outstanding requests among available replicas, ties broken at random"""
+    now = time.monotonic()
+    candidates = [replica for replica in ml_client.replicas if replica not in exclude and replica.available(now)]
+    if not candidates and not exclude:
+        # Every replica is ejected: try one anyway rather than fail outright
+        candidates = ml_client.replicas
+    if not candidates:
+        return None
+    lowest = min(replica.outstanding for replica in candidates)
+    return random.choice([replica for replica in candidates if replica.outstanding == lowest])
+
+def request_kwargs(upload) -> Dict:
+    """httpx arguments for a files dict, or for a streamed upload (see upload_stream.MultipartFile)"""
+    if isinstance(upload, dict):
+        return {"files": upload}
+    return upload.request_kwargs()
+
+async def send_to_replica(replica: Replica, upload) -> httpx.Response:
+    replica.outstanding += 1
+    started = time.perf_counter()
+    try:
+        response = await ml_client.client.post(replica.url, **request_kwargs(upload))
+    except httpx.RequestError:
+        replica.record_failure()
+        raise
+    finally:
+        replica.outstanding -= 1
+    if response.status_code in BREAKER_STATUSES:
+        replica.record_failure()
+    elif response.status_code < 500:
+        replica.record_success(time.perf_counter() - started)
+    elif not (response.status_code == 503 and "Retry-After" in response.headers):
+        logger.warning(f"ML replica {replica.url} answered {response.status_code}")
+    if response.status_code == 200:
+        replica.model_version = response.headers.get("X-Model-Version")
+        replica.fingerprint = response.headers.get("X-Model-Fingerprint")
+    return response
+
+async def post_prediction(upload) -> httpx.Response:
+    """
+    POST a prediction request (a files dict of bytes, or a streamed upload;
+    either can be resent) to the best replica. A slow request is hedged to a
+    second replica after ML_HEDGE_AFTER_MS, and a failed one is retried once
+    on another replica.
+    The first response below 500 wins; otherwise the last response is
+    returned, or the last transport error raised.
+    """
+    tried: List[Replica] = []
+    pending = set()
+    last_response, last_error = None, None
+
+    def launch() -> bool:
+        replica = choose_replica(tried)
+        if replica is None:
+            return False
+        tried.append(replica)
+        pending.add(asyncio.create_task(send_to_replica(replica, upload)))
+        return True
+
+    launch()
+    hedged = retried = False
+    try:
+        while pending:
+            timeout = ML_HEDGE_AFTER_MS / 1000 if ML_HEDGE_AFTER_MS and not hedged else None
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                hedged = True
+                launch()
+                continue
+            for task in done:
+                pending.discard(task)
+                try:
+                    response = task.result()
+                except httpx.RequestError as e:
+                    last_error = e
+                    continue
+                if response.status_code < 500:
+                    return response
+                last_response = response
+            if not pending and not retried:
+                retried = True
+                launch()
+    finally:
+        for task in pending:
+            task.cancel()
+
+    if last_response is not None:
+        return last_response
+    raise last_error
+
+def served_fingerprint() -> Optional[str]:
+    """
+    Fingerprint of the model every replica in rotation serves, or None while
+    they disagree (e.g. mid-rollout) or it is not known yet
+    """
+    fingerprints = {
+        replica.fingerprint for replica in ml_client.replicas if replica.healthy and replica.state != OPEN
+    }
+    return fingerprints.pop() if len(fingerprints) == 1 else None
+
+def describe_replicas() -> List[Dict]:
+    return [replica.describe() for replica in ml_client.replicas]
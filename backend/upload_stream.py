@@ -0,0 +1,97 @@
+"""
+Streaming Upload Handling
+Uploads are read once, in fixed-size chunks: the size limit is enforced, the
+SHA-256 is computed and the bytes are written to disk without blocking the
+event loop, all in the same pass. Saved files are forwarded to the ML service
+as a chunked multipart body, so no step holds a whole recording in memory.
+"""
+import os
+import uuid
+import hashlib
+import secrets
+from typing import AsyncIterator, Dict
+
+import aiofiles
+import aiofiles.os
+from fastapi import HTTPException, UploadFile
+
+# Bytes read, hashed and written per step; bounds memory per upload
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(256 * 1024)))
+
+class StoredUpload:
+    """An upload written to disk, with its size and content hash"""
+    def __init__(self, path: str, filename: str, content_type: str, size: int, sha256: str):
+        self.path = path
+        self.filename = filename
+        self.content_type = content_type
+        self.size = size
+        self.sha256 = sha256
+
+    def multipart(self, field: str = "audio_file", content_type: str = "audio/wav") -> "MultipartFile":
+        return MultipartFile(self.path, field, self.filename, content_type)
+
+async def save_upload(file: UploadFile, path: str, max_size: int) -> StoredUpload:
+    """
+    Stream an upload to `path` in one pass, rejecting it with 413 as soon as
+    it exceeds max_size. Written to a temporary name first, so a rejected or
+    interrupted upload never leaves a partial file at `path`.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    partial_path = f"{path}.{uuid.uuid4().hex}.part"
+
+    try:
+        async with aiofiles.open(partial_path, "wb") as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_size:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"File too large. Maximum size is {max_size / (1024*1024):.0f}MB"
+                    )
+                digest.update(chunk)
+                await buffer.write(chunk)
+        await aiofiles.os.replace(partial_path, path)
+    except BaseException:
+        if await aiofiles.os.path.exists(partial_path):
+            await aiofiles.os.remove(partial_path)
+        raise
+
+    return StoredUpload(path, file.filename, file.content_type or "application/octet-stream", size, digest.hexdigest())
+
+def _quote(value: str) -> str:
+    """Header-safe form of a multipart filename"""
+    return value.replace("\\", "\\\\").replace('"', "%22").replace("\r", "").replace("\n", "")
+
+class MultipartFile:
+    """
+    A file on disk sent as a one-field multipart/form-data body. Every call to
+    request_kwargs() starts a fresh stream, so the same upload can be resent
+    (retried or hedged to another ML replica).
+    """
+    def __init__(self, path: str, field: str, filename: str, content_type: str):
+        self.path = path
+        self.boundary = secrets.token_hex(16)
+        self.head = (
+            f"--{self.boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field}"; filename="{_quote(filename)}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n"
+        ).encode()
+        self.tail = f"\r\n--{self.boundary}--\r\n".encode()
+
+    async def stream(self) -> AsyncIterator[bytes]:
+        yield self.head
+        async with aiofiles.open(self.path, "rb") as f:
+            while chunk := await f.read(UPLOAD_CHUNK_SIZE):
+                yield chunk
+        yield self.tail
+
+    def request_kwargs(self) -> Dict:
+        length = len(self.head) + os.path.getsize(self.path) + len(self.tail)
+        return {
+            "content": self.stream(),
+            "headers": {
+                "Content-Type": f"multipart/form-data; boundary={self.boundary}",
+                "Content-Length": str(length),
+            },
+        }
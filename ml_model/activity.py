@@ -0,0 +1,129 @@
+"""
+Energy-based silence trimming and breath activity detection
+Runs on the decoded signal before MFCC, so silent lead-in/tail is never transformed
+and recordings with nothing in them never reach the model
+"""
+import os
+from typing import Tuple
+
+import numpy as np
+
+# Drop leading and trailing frames quieter than SILENCE_TOP_DB below the loudest frame
+SILENCE_TRIM = os.getenv("SILENCE_TRIM", "false").strip().lower() in ("1", "true", "yes")
+SILENCE_TOP_DB = float(os.getenv("SILENCE_TOP_DB", "40"))
+
+# Reject recordings whose loudest frame is below ACTIVITY_MIN_DBFS, or with less
+# than ACTIVITY_MIN_SECONDS of frames above both thresholds
+REJECT_SILENT_AUDIO = os.getenv("REJECT_SILENT_AUDIO", "false").strip().lower() in ("1", "true", "yes")
+ACTIVITY_MIN_DBFS = float(os.getenv("ACTIVITY_MIN_DBFS", "-60"))
+ACTIVITY_MIN_SECONDS = float(os.getenv("ACTIVITY_MIN_SECONDS", "0.5"))
+
+# Same framing as the MFCC STFT
+FRAME_LENGTH = 2048
+HOP_LENGTH = 512
+
+# Audio kept either side of the active region so breath onsets aren't clipped
+TRIM_MARGIN_SECONDS = 0.1
+
+
+class NoActivityError(ValueError):
+    """Recording has no detectable breath activity"""
+
+    def __init__(self, message: str, active_seconds: float, peak_dbfs: float):
+        super().__init__(message)
+        self.active_seconds = active_seconds
+        self.peak_dbfs = peak_dbfs
+
+    def __reduce__(self):
+        # Raised in feature pool workers, so it has to survive pickling intact
+        return (NoActivityError, (str(self), self.active_seconds, self.peak_dbfs))
+
+    def to_dict(self) -> dict:
+        return {
+            "error": "no_activity",
+            "message": str(self),
+            "active_seconds": round(self.active_seconds, 3),
+            "peak_dbfs": round(self.peak_dbfs, 1),
+        }
+
+
+def frame_starts(num_samples: int, frame_length: int = FRAME_LENGTH, hop_length: int = HOP_LENGTH) -> np.ndarray:
+    """First sample of each frame, with a last frame aligned to the end so the tail is covered"""
+    frame_length = min(frame_length, num_samples)
+    starts = np.arange(0, num_samples - frame_length + 1, hop_length)
+    if starts[-1] + frame_length < num_samples:
+        starts = np.append(starts, num_samples - frame_length)
+    return starts
+
+
+def frame_energy_db(y: np.ndarray, frame_length: int = FRAME_LENGTH, hop_length: int = HOP_LENGTH) -> np.ndarray:
+    """Mean power per frame_starts() frame in dBFS, from a running sum of squares (one pass over the signal)"""
+    y = np.asarray(y, dtype=np.float64)
+    if y.size == 0:
+        return np.full(1, -100.0)
+    starts = frame_starts(y.size, frame_length, hop_length)
+    frame_length = min(frame_length, y.size)
+    cumulative = np.concatenate(([0.0], np.cumsum(y * y)))
+    power = (cumulative[starts + frame_length] - cumulative[starts]) / frame_length
+    return 10.0 * np.log10(np.maximum(power, 1e-10))
+
+
+def frame_shares(starts: np.ndarray, frame_length: int, num_samples: int) -> np.ndarray:
+    """
+    Samples each frame stands for: the signal is split halfway between
+    neighbouring frame centres, so the shares add up to the whole signal
+    """
+    centres = starts + frame_length / 2.0
+    bounds = np.concatenate(([0.0], (centres[:-1] + centres[1:]) / 2.0, [float(num_samples)]))
+    return np.diff(bounds)
+
+
+def is_enabled() -> bool:
+    return SILENCE_TRIM or REJECT_SILENT_AUDIO
+
+
+def config_tag() -> str:
+    """Part of the prediction cache key, since trimming and rejection change the answer"""
+    tag = f"trim{SILENCE_TOP_DB:g}" if SILENCE_TRIM else ""
+    if REJECT_SILENT_AUDIO:
+        tag += f"gate{ACTIVITY_MIN_DBFS:g},{ACTIVITY_MIN_SECONDS:g}"
+    return tag
+
+
+def apply_activity_gate(y: np.ndarray, sr: int) -> Tuple[np.ndarray, float]:
+    """
+    Reject silent recordings and/or trim silent edges, as configured. Returns
+    the (possibly trimmed) signal and the offset in seconds of its first sample.
+    """
+    if not is_enabled():
+        return y, 0.0
+
+    energy = frame_energy_db(y)
+    starts = frame_starts(len(y))
+    frame_length = min(FRAME_LENGTH, len(y))
+    peak = float(energy.max())
+    relative = energy > peak - SILENCE_TOP_DB
+
+    if REJECT_SILENT_AUDIO:
+        # Measured in samples rather than hops, since a short clip has few (overlapping) frames
+        shares = frame_shares(starts, frame_length, len(y))
+        active_seconds = float(shares[relative & (energy > ACTIVITY_MIN_DBFS)].sum()) / sr
+        if peak < ACTIVITY_MIN_DBFS:
+            raise NoActivityError(
+                f"Recording is silent (peak {peak:.1f} dBFS, threshold {ACTIVITY_MIN_DBFS:g} dBFS)",
+                active_seconds, peak,
+            )
+        if active_seconds < ACTIVITY_MIN_SECONDS:
+            raise NoActivityError(
+                f"Only {active_seconds:.2f}s of breath activity detected; at least {ACTIVITY_MIN_SECONDS:g}s is required",
+                active_seconds, peak,
+            )
+
+    if not SILENCE_TRIM:
+        return y, 0.0
+
+    active = np.flatnonzero(relative)
+    margin = int(TRIM_MARGIN_SECONDS * sr)
+    start = max(0, int(starts[active[0]]) - margin)
+    end = min(len(y), int(starts[active[-1]]) + frame_length + margin)
+    return y[start:end], start / float(sr)
@@ -0,0 +1,290 @@
+"""
+Admission control for inference requests
+Bounds the work in flight, estimates each request's cost from its audio
+duration and sheds load up front when it could not finish before its deadline
+"""
+import io
+import os
+import json
+import math
+import asyncio
+import logging
+import threading
+import contextvars
+from typing import Optional, Sequence
+
+import soundfile as sf
+from starlette.responses import StreamingResponse
+
+from metrics import Counter, Gauge, Histogram
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Requests admitted at once and how long a request may take end to end (0
+# disables either). Keep the deadline below the backend's ML client timeout.
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "30"))
+
+# Requests that can be worked on in parallel, and the starting guess for
+# processing seconds per second of audio (refined from completed requests)
+ADMISSION_CAPACITY = int(os.getenv("ADMISSION_CAPACITY", str(os.cpu_count() or 1)))
+ADMISSION_INITIAL_RATE = float(os.getenv("ADMISSION_INITIAL_RATE", "0.02"))
+
+# How often a waiting request checks whether its client is still connected
+DISCONNECT_POLL_SECONDS = 0.25
+
+# Cost of a request without audio (precomputed MFCC), in audio seconds
+MIN_COST_SECONDS = 1.0
+
+REJECTIONS = Counter("ml_admission_rejections_total", "Requests shed by admission control", ["reason"])
+ABANDONED = Counter("ml_admission_abandoned_total", "Admitted requests cancelled before finishing", ["reason"])
+ESTIMATE_ERROR = Histogram(
+    "ml_admission_estimate_ratio",
+    "Actual over estimated processing time of admitted requests",
+    buckets=(0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 4.0, 8.0),
+)
+
+
+class AdmissionError(Exception):
+    """Request was not (or no longer) worth processing"""
+
+
+class Overloaded(AdmissionError):
+    def __init__(self, message: str, retry_after: int, reason: str):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class DeadlineExceeded(AdmissionError):
+    pass
+
+
+class ClientDisconnected(AdmissionError):
+    pass
+
+
+def audio_seconds(content: bytes, sample_rate: int = 0, channels: int = 1) -> float:
+    """Duration of an upload from its header (or of raw PCM from its size)"""
+    if sample_rate:
+        return len(content) / float(2 * max(1, channels) * sample_rate)
+    try:
+        info = sf.info(io.BytesIO(content))
+        return info.frames / float(info.samplerate)
+    except Exception:
+        # Unreadable header: assume 16-bit mono at 22.05 kHz
+        return len(content) / (2 * 22050.0)
+
+
+# Ticket of the request the current task works for; feature extraction and the
+# batcher charge their processing time to it (see record_service)
+_current_ticket: contextvars.ContextVar = contextvars.ContextVar("admission_ticket", default=None)
+
+
+def record_service(seconds: float):
+    """Charge processing time to the admitted request being served, if any"""
+    ticket = _current_ticket.get()
+    if ticket is not None:
+        ticket.service += seconds
+
+
+class Ticket:
+    """
+    An admitted request; releases its share of the queue when closed. A ticket
+    dropped without being closed is released when it is garbage collected.
+    """
+
+    def __init__(self, controller: "AdmissionController", estimate: float, duration: float):
+        self.controller = controller
+        self.estimate = estimate
+        self.duration = duration
+        # Seconds actually spent decoding, extracting and in forward passes,
+        # excluding any time spent waiting for a worker or a batch
+        self.service = 0.0
+        self.completed = False
+        self.closed = False
+        self._token = None
+
+    def complete(self):
+        self.completed = True
+
+    def activate(self):
+        """Charge work started from the current task (and tasks it creates) to this ticket"""
+        _current_ticket.set(self)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.controller.release(self)
+
+    def __enter__(self):
+        self._token = _current_ticket.set(self)
+        return self
+
+    def __exit__(self, *exc):
+        _current_ticket.reset(self._token)
+        self.close()
+
+    def __del__(self):
+        if not self.closed:
+            self.closed = True
+            self.controller.release(self)
+
+
+class AdmissionController:
+    """Tracks admitted work and its estimated cost"""
+
+    def __init__(self, max_queue: int = ADMISSION_MAX_QUEUE, deadline: float = REQUEST_DEADLINE_SECONDS,
+                 capacity: int = ADMISSION_CAPACITY, initial_rate: float = ADMISSION_INITIAL_RATE):
+        self.max_queue = max(0, max_queue)
+        self.deadline = deadline
+        self.capacity = max(1, capacity)
+        self.rate = initial_rate
+        self.in_flight = 0
+        self.outstanding = 0.0
+        # Reentrant: a ticket's finalizer may run while this thread holds it
+        self._lock = threading.RLock()
+        Gauge("ml_admission_in_flight", "Requests admitted and not yet finished", function=lambda: self.in_flight)
+        Gauge(
+            "ml_admission_estimated_wait_seconds",
+            "Estimated time before a newly admitted request starts",
+            function=self.estimated_wait,
+        )
+
+    def estimated_wait(self) -> float:
+        return self.outstanding / self.capacity
+
+    def _retry_after(self) -> int:
+        return int(min(60, max(1, math.ceil(self.estimated_wait()))))
+
+    def check_queue(self):
+        """
+        Cheap check before reading a request body. Multipart endpoints are parsed
+        before their handler runs, so AdmissionMiddleware makes it for them.
+        """
+        if self.max_queue and self.in_flight >= self.max_queue:
+            REJECTIONS.inc("queue_full")
+            raise Overloaded(f"Server busy: {self.in_flight} requests in progress", self._retry_after(), "queue_full")
+
+    def admit(self, duration: float, budget: Optional[float] = None) -> Ticket:
+        """
+        Admit a request for `duration` seconds of audio if the work already
+        admitted leaves time to finish it within `budget` seconds (None: no deadline)
+        """
+        with self._lock:
+            if self.max_queue and self.in_flight >= self.max_queue:
+                REJECTIONS.inc("queue_full")
+                raise Overloaded(
+                    f"Server busy: {self.in_flight} requests in progress", self._retry_after(), "queue_full"
+                )
+            estimate = self.rate * max(duration, MIN_COST_SECONDS)
+            wait = self.estimated_wait()
+            if budget is not None and wait + estimate > budget:
+                REJECTIONS.inc("deadline")
+                raise Overloaded(
+                    f"Server busy: estimated {wait + estimate:.1f}s to finish, deadline {budget:.1f}s",
+                    self._retry_after(), "deadline",
+                )
+            self.in_flight += 1
+            self.outstanding += estimate
+        return Ticket(self, estimate, duration)
+
+    def release(self, ticket: Ticket):
+        # Learned from service time only: queueing is already accounted for by
+        # estimated_wait(), so counting it here as well would inflate estimates
+        # exactly when the server is busy
+        learn = ticket.completed and ticket.service > 0
+        with self._lock:
+            self.in_flight -= 1
+            self.outstanding = max(0.0, self.outstanding - ticket.estimate)
+            if learn:
+                observed = ticket.service / max(ticket.duration, MIN_COST_SECONDS)
+                self.rate += 0.1 * (observed - self.rate)
+        if learn and ticket.estimate:
+            ESTIMATE_ERROR.observe(ticket.service / ticket.estimate)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_queue": self.max_queue,
+            "estimated_wait_seconds": round(self.estimated_wait(), 3),
+            "seconds_per_audio_second": round(self.rate, 5),
+            "deadline_seconds": self.deadline,
+        }
+
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """
+    A streaming response that holds an admission ticket until it has been sent
+    or abandoned. The ticket is released here rather than in the body generator,
+    which never runs if the client goes away before the response starts.
+    """
+
+    def __init__(self, content, ticket: Ticket, **kwargs):
+        super().__init__(content, **kwargs)
+        self.ticket = ticket
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.ticket.close()
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware making the queue check for the given paths before the
+    request body is read, so a full server does not first receive and parse
+    a multipart upload only to refuse it
+    """
+
+    def __init__(self, app, controller: AdmissionController, paths: Sequence[str]):
+        self.app = app
+        self.controller = controller
+        self.paths = frozenset(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope.get("path") in self.paths:
+            try:
+                self.controller.check_queue()
+            except Overloaded as e:
+                body = json.dumps({"detail": str(e)}).encode("utf-8")
+                await send({
+                    "type": "http.response.start",
+                    "status": 503,
+                    "headers": [
+                        (b"content-type", b"application/json"),
+                        (b"content-length", str(len(body)).encode("latin-1")),
+                        (b"retry-after", str(e.retry_after).encode("latin-1")),
+                    ],
+                })
+                await send({"type": "http.response.body", "body": body})
+                return
+        await self.app(scope, receive, send)
+
+
+async def run_guarded(request, awaitable, timeout: Optional[float]):
+    """
+    Await work until it finishes, the deadline passes or the client goes away.
+    The work is cancelled in the latter two cases, so queued feature extraction
+    and batch slots are freed for requests someone is still waiting for.
+    """
+    loop = asyncio.get_running_loop()
+    task = asyncio.ensure_future(awaitable)
+    deadline = loop.time() + timeout if timeout is not None else float("inf")
+    try:
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                ABANDONED.inc("deadline")
+                raise DeadlineExceeded(f"Request did not finish within {timeout:.1f}s")
+            done, _ = await asyncio.wait({task}, timeout=min(DISCONNECT_POLL_SECONDS, remaining))
+            if done:
+                return task.result()
+            if request is not None and await request.is_disconnected():
+                ABANDONED.inc("disconnected")
+                raise ClientDisconnected("Client disconnected")
+    finally:
+        if not task.done():
+            task.cancel()
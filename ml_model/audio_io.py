@@ -0,0 +1,179 @@
+"""
+Audio decoding for the inference service
+Decodes uploaded bytes in memory, falling back to a temp file for formats that need a path
+"""
+import io
+import os
+import math
+import logging
+import tarfile
+import tempfile
+import zipfile
+from typing import List, Tuple
+
+import numpy as np
+import soundfile as sf
+from scipy.signal import resample_poly
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Canonical sample rate applied right after decode (0 keeps the native rate) and
+# the longest recording accepted, in seconds (0 disables the cap)
+TARGET_SAMPLE_RATE = int(os.getenv("TARGET_SAMPLE_RATE", "0"))
+MAX_AUDIO_SECONDS = float(os.getenv("MAX_AUDIO_SECONDS", "0"))
+
+# Largest decompressed archive member, and total decompressed bytes read from
+# one archive, so a small zip or tar.gz bomb cannot exhaust memory
+MAX_ARCHIVE_MEMBER_BYTES = int(os.getenv("MAX_ARCHIVE_MEMBER_BYTES", str(50 * 1024 * 1024)))
+MAX_ARCHIVE_TOTAL_BYTES = int(os.getenv("MAX_ARCHIVE_TOTAL_BYTES", str(512 * 1024 * 1024)))
+
+AUDIO_EXTENSIONS = (".wav", ".wave")
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz")
+
+
+class AudioTooLongError(ValueError):
+    """Recording exceeds MAX_AUDIO_SECONDS"""
+
+
+def is_audio_filename(filename: str) -> bool:
+    return filename.lower().endswith(AUDIO_EXTENSIONS)
+
+
+def is_archive_filename(filename: str) -> bool:
+    return filename.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def read_archive(filename: str, content: bytes, max_files: int,
+                 max_member_bytes: int = MAX_ARCHIVE_MEMBER_BYTES,
+                 max_total_bytes: int = MAX_ARCHIVE_TOTAL_BYTES) -> List[Tuple[str, bytes]]:
+    """
+    Return (name, bytes) for every WAV member of a zip or tar archive. Members
+    are checked against the size limits before they are decompressed, and read
+    no further than the limit in case the archive understates their size.
+    """
+    members = []
+    total = 0
+
+    def check_size(name, size):
+        if size > max_member_bytes:
+            raise ValueError(f"Archive member {name} exceeds {max_member_bytes} bytes")
+        if total + size > max_total_bytes:
+            raise ValueError(f"Archive expands to more than {max_total_bytes} bytes")
+
+    def read_member(name, size, open_member):
+        nonlocal total
+        check_size(name, size)
+        with open_member() as member:
+            data = member.read(min(max_member_bytes, max_total_bytes - total) + 1)
+        check_size(name, len(data))
+        total += len(data)
+        members.append((name, data))
+
+    try:
+        if filename.lower().endswith(".zip"):
+            with zipfile.ZipFile(io.BytesIO(content)) as archive:
+                for info in archive.infolist():
+                    if info.is_dir() or not is_audio_filename(info.filename):
+                        continue
+                    if len(members) >= max_files:
+                        raise ValueError(f"Archive contains more than {max_files} recordings")
+                    read_member(info.filename, info.file_size, lambda: archive.open(info))
+        else:
+            with tarfile.open(fileobj=io.BytesIO(content), mode="r:*") as archive:
+                for info in archive:
+                    if not info.isfile() or not is_audio_filename(info.name):
+                        continue
+                    if len(members) >= max_files:
+                        raise ValueError(f"Archive contains more than {max_files} recordings")
+                    read_member(info.name, info.size, lambda: archive.extractfile(info))
+    except (zipfile.BadZipFile, tarfile.TarError) as e:
+        raise ValueError(f"Invalid archive {filename}: {str(e)}")
+    return members
+
+
+def decode_audio(content: bytes, suffix: str = ".wav", target_sr: int = TARGET_SAMPLE_RATE,
+                 max_seconds: float = MAX_AUDIO_SECONDS) -> Tuple[np.ndarray, int]:
+    """
+    Decode audio bytes to a mono float32 signal, resampled to target_sr when it
+    is set, rejecting recordings longer than max_seconds
+    """
+    if not content:
+        raise ValueError("Empty audio file")
+    try:
+        y, sr = _decode_in_memory(content, max_seconds)
+    except AudioTooLongError:
+        raise
+    except Exception as e:
+        logger.info(f"In-memory decode failed ({str(e)}), falling back to temp file")
+        y, sr = _decode_via_tempfile(content, suffix)
+        _check_duration(len(y), sr, max_seconds)
+    return resample(y, sr, target_sr), (target_sr or sr)
+
+
+def pcm16_to_signal(content: bytes, sample_rate: int, channels: int = 1, target_sr: int = TARGET_SAMPLE_RATE,
+                    max_seconds: float = MAX_AUDIO_SECONDS) -> Tuple[np.ndarray, int]:
+    """
+    Headerless little-endian 16-bit PCM (interleaved when channels > 1) to the
+    same mono float32 signal decode_audio produces for a WAV of that data
+    """
+    if not content:
+        raise ValueError("Empty audio body")
+    if not 1000 <= sample_rate <= 384000:
+        raise ValueError(f"Unsupported sample rate {sample_rate}")
+    if not 1 <= channels <= 8:
+        raise ValueError(f"Unsupported channel count {channels}")
+    if len(content) % (2 * channels):
+        raise ValueError(f"Body is {len(content)} bytes, not a whole number of {channels}-channel 16-bit frames")
+    _check_duration(len(content) // (2 * channels), sample_rate, max_seconds)
+
+    pcm = np.frombuffer(content, dtype="<i2").reshape(-1, channels)
+    # Same scaling libsndfile applies when reading PCM_16 as float
+    y = pcm[:, 0].astype(np.float32) if channels == 1 else pcm.astype(np.float32).mean(axis=1, dtype=np.float32)
+    y *= 1.0 / 32768.0
+    return resample(y, sample_rate, target_sr), (target_sr or sample_rate)
+
+
+def resample(y: np.ndarray, sr: int, target_sr: int) -> np.ndarray:
+    """Polyphase resampling to target_sr (no-op when unset or already there)"""
+    if not target_sr or sr == target_sr:
+        return y
+    factor = math.gcd(int(sr), int(target_sr))
+    y = resample_poly(y, int(target_sr) // factor, int(sr) // factor)
+    return np.ascontiguousarray(y, dtype=np.float32)
+
+
+def _check_duration(frames: int, sr: int, max_seconds: float):
+    if max_seconds and sr and frames / sr > max_seconds:
+        raise AudioTooLongError(
+            f"Recording is {frames / sr:.1f}s long; the maximum is {max_seconds:g}s"
+        )
+
+
+def _decode_in_memory(content: bytes, max_seconds: float) -> Tuple[np.ndarray, int]:
+    with sf.SoundFile(io.BytesIO(content)) as audio:
+        # The header gives the duration, so over-long uploads are never decoded
+        _check_duration(audio.frames, audio.samplerate, max_seconds)
+        y = audio.read(dtype="float32", always_2d=True)
+        sr = audio.samplerate
+    # Average channels the same way librosa.load(mono=True) does
+    if y.shape[1] == 1:
+        y = y[:, 0]
+    else:
+        y = y.mean(axis=1, dtype=np.float32)
+    return np.ascontiguousarray(y), sr
+
+
+def _decode_via_tempfile(content: bytes, suffix: str) -> Tuple[np.ndarray, int]:
+    tmp_fd, tmp_path = tempfile.mkstemp(suffix=suffix)
+    try:
+        with os.fdopen(tmp_fd, "wb") as tmp_file:
+            tmp_file.write(content)
+        import librosa  # Only needed for formats libsndfile can't read
+        y, sr = librosa.load(tmp_path, sr=None)
+        return y.astype(np.float32, copy=False), sr
+    finally:
+        try:
+            os.unlink(tmp_path)
+        except Exception:
+            pass  # Ignore cleanup errors
@@ -0,0 +1,164 @@
+"""
+Dynamic micro-batching for model inference
+Collects feature tensors from concurrent requests and runs one batched forward pass
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from admission import record_service
+from metrics import BATCH_ROWS, STAGE_SECONDS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Upper bound on rows in one forward pass, and how long the first request in a
+# batch may wait for others to join it.
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "32"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "5"))
+
+
+class InferenceBatcher:
+    """Queue in front of the model that merges concurrent predict calls"""
+
+    def __init__(
+        self,
+        predict_fn: Callable[[np.ndarray], np.ndarray],
+        max_batch_size: int = BATCH_MAX_SIZE,
+        max_wait_ms: float = BATCH_MAX_WAIT_MS,
+        executor=None,
+    ):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.executor = executor
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    @property
+    def queue_depth(self) -> int:
+        """Requests waiting for a forward pass"""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self):
+        """Start the background batching loop"""
+        if self._worker is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+        logger.info(
+            f"Inference batcher started - max batch {self.max_batch_size}, "
+            f"max wait {self.max_wait * 1000:.1f}ms"
+        )
+
+    async def stop(self):
+        """Stop the batching loop and fail any requests still queued"""
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+        while not self._queue.empty():
+            _, future, _ = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Inference batcher stopped"))
+
+    async def submit(self, features: np.ndarray) -> np.ndarray:
+        """
+        Queue a batch of feature tensors (leading axis is the batch) and wait for
+        the matching rows of model output.
+        """
+        if self._worker is None:
+            raise RuntimeError("Inference batcher is not running")
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        await self._queue.put((features, future, loop.time()))
+        outputs, service = await future
+        record_service(service)
+        return outputs
+
+    async def _collect(self) -> List[Tuple[np.ndarray, asyncio.Future, float]]:
+        """Wait for one request, then gather more until the batch is full or the wait expires"""
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        rows = len(batch[0][0])
+        deadline = loop.time() + self.max_wait
+
+        while rows < self.max_batch_size:
+            if self._queue.empty():
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                item = self._queue.get_nowait()
+            batch.append(item)
+            rows += len(item[0])
+
+        # Requests whose caller went away do not need a forward pass; _run splits
+        # the rows into passes of at most max_batch_size
+        return [item for item in batch if not item[1].done()]
+
+    def _timed_predict(self, inputs: np.ndarray):
+        # Timed on the executor thread so executor queueing isn't counted as inference
+        started = time.perf_counter()
+        outputs = self.predict_fn(inputs)
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, "inference")
+        return outputs, elapsed
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            if not batch:
+                continue
+
+            dispatched = loop.time()
+            for _, _, enqueued in batch:
+                STAGE_SECONDS.observe(dispatched - enqueued, "queue_wait")
+
+            try:
+                inputs = np.concatenate([features for features, _, _ in batch], axis=0)
+                # The last request collected (or a single large one) can take the
+                # batch past the limit, so the forward passes are split to stay within it
+                chunks, elapsed = [], 0.0
+                for start in range(0, len(inputs), self.max_batch_size):
+                    chunk = inputs[start:start + self.max_batch_size]
+                    BATCH_ROWS.observe(len(chunk))
+                    chunk_outputs, chunk_elapsed = await loop.run_in_executor(
+                        self.executor, self._timed_predict, chunk
+                    )
+                    chunk_outputs = np.asarray(chunk_outputs)
+                    if chunk_outputs.shape[0] != chunk.shape[0]:
+                        raise ValueError(
+                            f"Model returned {chunk_outputs.shape[0]} rows for a batch of {chunk.shape[0]}"
+                        )
+                    chunks.append(chunk_outputs)
+                    elapsed += chunk_elapsed
+                outputs = np.concatenate(chunks, axis=0)
+            except Exception as e:
+                logger.error(f"Batched inference failed for {len(batch)} requests: {str(e)}")
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            # Each request is charged its rows' share of the forward pass
+            offset = 0
+            for features, future, _ in batch:
+                count = len(features)
+                if not future.done():
+                    future.set_result((outputs[offset:offset + count], elapsed * count / len(inputs)))
+                offset += count
@@ -0,0 +1,325 @@
+"""
+Latency and throughput benchmark for the inference service
+Synthetic WAVs are timed through each stage (decode, MFCC, inference) and
+through /predict, in-process or against a running server
+
+    python benchmark.py --duration 10 --sample-rate 22050 --requests 200 --concurrency 8
+    python benchmark.py --stages http --url http://localhost:8001 --server-pid 1234
+    python benchmark.py --output results/$(git rev-parse --short HEAD).json
+"""
+import io
+import os
+import sys
+import json
+import time
+import wave
+import asyncio
+import logging
+import argparse
+import platform
+import resource
+import threading
+import subprocess
+
+import numpy as np
+
+STAGES = ("decode", "mfcc", "inference", "inprocess", "http")
+
+# One log line per request would dominate the timings
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+def synthetic_wav(duration: float, sample_rate: int, seed: int = 0) -> bytes:
+    """16-bit mono WAV of amplitude-modulated noise, roughly like breathing"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(duration * sample_rate)) / sample_rate
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * rng.uniform(0.2, 0.5) * t)
+    y = np.clip(envelope * rng.standard_normal(t.size) * 0.1, -1.0, 1.0)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes((y * 32767).astype("<i2").tobytes())
+    return buffer.getvalue()
+
+
+def unique_variant(content: bytes, index: int) -> bytes:
+    """Overwrite the first two samples with the request index so no two uploads share a cache entry"""
+    # The wave module always writes a 44-byte header for PCM
+    return content[:44] + int(index).to_bytes(4, "little", signed=False) + content[48:]
+
+
+def _rss_bytes(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        pass
+    return 0
+
+
+def _child_pids(pid: int):
+    children = []
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children", "r") as f:
+                children.extend(int(child) for child in f.read().split())
+    except (FileNotFoundError, PermissionError):
+        pass
+    return children
+
+
+class RssSampler:
+    """Samples resident memory of a process and its children (e.g. feature pool workers)"""
+
+    def __init__(self, pid: int = 0, interval: float = 0.01):
+        self.pid = pid or os.getpid()
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self) -> int:
+        return _rss_bytes(self.pid) + sum(_rss_bytes(child) for child in _child_pids(self.pid))
+
+    def __enter__(self):
+        self.peak = self.sample()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.sample())
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.sample())
+        if not self.peak and self.pid == os.getpid():
+            # No /proc (e.g. macOS): fall back to the lifetime peak of this process
+            scale = 1 if sys.platform == "darwin" else 1024
+            self.peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def summarize(latencies, errors: int, wall_seconds: float, peak_rss: int) -> dict:
+    latencies_ms = np.asarray(latencies, dtype=np.float64) * 1000.0
+    summary = {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "wall_seconds": round(wall_seconds, 3),
+        "rps": round(len(latencies) / wall_seconds, 2) if wall_seconds > 0 else 0.0,
+        "peak_rss_mb": round(peak_rss / (1024 * 1024), 1),
+    }
+    if latencies_ms.size:
+        p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+        summary.update({
+            "mean_ms": round(float(latencies_ms.mean()), 3),
+            "p50_ms": round(float(p50), 3),
+            "p95_ms": round(float(p95), 3),
+            "p99_ms": round(float(p99), 3),
+            "max_ms": round(float(latencies_ms.max()), 3),
+        })
+    return summary
+
+
+def time_calls(fn, inputs, warmup: int):
+    """Sequential single-call latency of one pipeline stage"""
+    for item in inputs[:warmup]:
+        fn(item)
+    latencies, errors = [], 0
+    with RssSampler() as rss:
+        started = time.perf_counter()
+        for item in inputs:
+            call_started = time.perf_counter()
+            try:
+                fn(item)
+                latencies.append(time.perf_counter() - call_started)
+            except Exception:
+                errors += 1
+        wall = time.perf_counter() - started
+    return summarize(latencies, errors, wall, rss.peak)
+
+
+async def drive(client, content: bytes, requests: int, concurrency: int, query: str, rss_pid: int = 0,
+                first_index: int = 0):
+    """POST /predict from `concurrency` workers until `requests` have been sent"""
+    latencies, failures = [], []
+    counter = iter(range(first_index, first_index + requests))
+
+    async def worker():
+        for index in counter:
+            upload = unique_variant(content, index)
+            started = time.perf_counter()
+            try:
+                response = await client.post(f"/predict{query}", files={"audio_file": ("bench.wav", upload)})
+                if response.status_code == 200:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    failures.append(response.status_code)
+            except Exception as e:
+                failures.append(type(e).__name__)
+
+    with RssSampler(rss_pid) as rss:
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(max(1, concurrency))])
+        wall = time.perf_counter() - started
+    summary = summarize(latencies, len(failures), wall, rss.peak)
+    summary["concurrency"] = concurrency
+    if failures:
+        summary["failures"] = {str(code): failures.count(code) for code in set(failures)}
+    return summary
+
+
+async def bench_inprocess(content: bytes, args) -> dict:
+    """Drive the FastAPI app through an ASGI transport, with its real batcher and feature pool"""
+    import httpx
+    import main
+    from prediction_cache import PredictionCache
+
+    await main.startup()
+    try:
+        await main.warm_up_task
+        if not main.startup_state["ready"]:
+            raise RuntimeError(f"Service failed to start: {main.startup_state['error']}")
+        if not args.cache:
+            main.prediction_cache = PredictionCache(0)
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=args.timeout) as client:
+            await drive(client, content, args.warmup, args.concurrency, args.query, first_index=1 << 30)
+            summary = await drive(client, content, args.requests, args.concurrency, args.query)
+        summary["startup_timings"] = main.startup_state["timings"]
+        return summary
+    finally:
+        await main.shutdown()
+
+
+async def bench_http(content: bytes, args) -> dict:
+    """Drive a running server; pass --server-pid to sample its memory instead of ours"""
+    import httpx
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        # Offset warm-up indices so they never share cache entries with measured requests
+        await drive(client, content, args.warmup, args.concurrency, args.query, first_index=1 << 30)
+        summary = await drive(client, content, args.requests, args.concurrency, args.query,
+                              rss_pid=args.server_pid)
+    summary["url"] = args.url
+    return summary
+
+
+def bench_stages(content: bytes, args, stages) -> dict:
+    from audio_io import decode_audio
+    from features import extract_features
+
+    results = {}
+    clips = [unique_variant(content, index) for index in range(args.requests)]
+    if "decode" in stages:
+        results["decode"] = time_calls(decode_audio, clips, args.warmup)
+
+    if "mfcc" in stages or "inference" in stages:
+        y, sr = decode_audio(content)
+    if "mfcc" in stages:
+        results["mfcc"] = time_calls(lambda _: extract_features(y, sr), clips, args.warmup)
+
+    if "inference" in stages:
+        from inference_backends import INFERENCE_BACKEND, load_backend
+
+        model_path = os.getenv("MODEL_PATH", "prediction_lung_disease_model.keras")
+        backend = load_backend(model_path, args.backend or INFERENCE_BACKEND)
+        features = extract_features(y, sr)[np.newaxis, ..., np.newaxis].astype(np.float32)
+        batch = np.repeat(features, args.batch_size, axis=0)
+        summary = time_calls(lambda _: backend.predict(batch), clips, args.warmup)
+        summary["backend"] = backend.name
+        summary["batch_size"] = args.batch_size
+        results["inference"] = summary
+    return results
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except Exception:
+        commit = ""
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+    }
+
+
+async def run(args) -> dict:
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        raise SystemExit(f"Unknown stage(s): {', '.join(sorted(unknown))}; expected {', '.join(STAGES)}")
+    if "http" in stages and not args.url:
+        raise SystemExit("--url is required for the http stage")
+
+    content = synthetic_wav(args.duration, args.sample_rate, args.seed)
+    report = {
+        "config": {
+            "duration": args.duration,
+            "sample_rate": args.sample_rate,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "warmup": args.warmup,
+            "query": args.query,
+            "cache": args.cache,
+            "upload_bytes": len(content),
+        },
+        "environment": environment(),
+        "stages": {},
+    }
+
+    loop = asyncio.get_running_loop()
+    report["stages"].update(await loop.run_in_executor(None, bench_stages, content, args, stages))
+    if "inprocess" in stages:
+        report["stages"]["inprocess"] = await bench_inprocess(content, args)
+    if "http" in stages:
+        report["stages"]["http"] = await bench_http(content, args)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stages", default="decode,mfcc,inference,inprocess",
+                        help=f"comma-separated subset of {','.join(STAGES)}")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of audio per request")
+    parser.add_argument("--sample-rate", type=int, default=22050)
+    parser.add_argument("--requests", type=int, default=100, help="measured requests per stage")
+    parser.add_argument("--warmup", type=int, default=5, help="unmeasured requests per stage")
+    parser.add_argument("--concurrency", type=int, default=8, help="parallel clients for /predict stages")
+    parser.add_argument("--batch-size", type=int, default=1, help="rows per forward pass in the inference stage")
+    parser.add_argument("--backend", default="", help="inference runtime (default: INFERENCE_BACKEND)")
+    parser.add_argument("--query", default="", help="appended to /predict, e.g. '?windowed=true'")
+    parser.add_argument("--cache", action="store_true", help="keep the in-process prediction cache enabled")
+    parser.add_argument("--url", default="", help="base URL of a running service for the http stage")
+    parser.add_argument("--server-pid", type=int, default=0, help="sample this process's memory in the http stage")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
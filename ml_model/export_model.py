@@ -0,0 +1,122 @@
+"""
+Export the Keras model to lighter runtimes and check they agree
+
+    python export_model.py tflite --quantize float16   # or int8, none
+    python export_model.py onnx
+    python export_model.py parity --backends keras,tflite,onnx --reference-dir samples/
+"""
+import os
+import sys
+import glob
+import argparse
+
+import numpy as np
+
+from features import extract_features
+from audio_io import decode_audio
+from inference_backends import INPUT_SHAPE, exported_model_path, load_backend
+
+MODEL_PATH = os.getenv("MODEL_PATH", "prediction_lung_disease_model.keras")
+
+
+def export_tflite(model_path: str, output: str, quantize: str):
+    """Convert to TFLite; int8 uses dynamic-range quantisation (float inputs and outputs)"""
+    import tensorflow as tf
+
+    model = tf.keras.models.load_model(model_path)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantize in ("float16", "int8"):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantize == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+
+    with open(output, "wb") as f:
+        f.write(converter.convert())
+
+
+def export_onnx(model_path: str, output: str, opset: int):
+    import tensorflow as tf
+    import tf2onnx
+
+    model = tf.keras.models.load_model(model_path)
+    signature = [tf.TensorSpec((None,) + INPUT_SHAPE, tf.float32, name="features")]
+    tf2onnx.convert.from_keras(model, input_signature=signature, opset=opset, output_path=output)
+
+
+def reference_set(reference_dir: str, samples: int) -> np.ndarray:
+    """MFCC inputs from WAV files in reference_dir, or synthetic breathing-like noise"""
+    features = []
+    if reference_dir:
+        for path in sorted(glob.glob(os.path.join(reference_dir, "**", "*.wav"), recursive=True))[:samples]:
+            with open(path, "rb") as f:
+                y, sr = decode_audio(f.read())
+            features.append(extract_features(y, sr))
+    rng = np.random.default_rng(0)
+    sr = 22050
+    while len(features) < samples:
+        t = np.arange(sr * 10) / sr
+        envelope = 0.5 + 0.5 * np.sin(2 * np.pi * rng.uniform(0.2, 0.5) * t)
+        y = (envelope * rng.standard_normal(t.size) * 0.1).astype(np.float32)
+        features.append(extract_features(y, sr))
+    return np.stack(features)[..., np.newaxis].astype(np.float32)
+
+
+def check_parity(backends, reference: np.ndarray, tolerance: float, quantize: str) -> bool:
+    """Compare every backend against the first one on the reference set"""
+    baseline_name = backends[0]
+    outputs = {
+        name: load_backend(MODEL_PATH, name, exported_model_path(MODEL_PATH, name, quantize)).predict(reference)
+        for name in backends
+    }
+    baseline = outputs[baseline_name]
+
+    ok = True
+    for name in backends[1:]:
+        diff = float(np.max(np.abs(outputs[name] - baseline)))
+        agreement = float(np.mean(np.argmax(outputs[name], axis=1) == np.argmax(baseline, axis=1)))
+        passed = diff <= tolerance
+        ok = ok and passed
+        print(f"{name} vs {baseline_name}: max_abs_diff={diff:.5f} top1_agreement={agreement:.1%} "
+              f"{'OK' if passed else 'FAIL'}")
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    tflite = sub.add_parser("tflite", help="export to TFLite")
+    tflite.add_argument("--quantize", choices=["float16", "int8", "none"], default="float16")
+    tflite.add_argument("--output")
+
+    onnx = sub.add_parser("onnx", help="export to ONNX")
+    onnx.add_argument("--opset", type=int, default=13)
+    onnx.add_argument("--output")
+
+    parity = sub.add_parser("parity", help="compare backend outputs on a reference set")
+    parity.add_argument("--backends", default="keras,tflite,onnx")
+    parity.add_argument("--reference-dir", default="")
+    parity.add_argument("--samples", type=int, default=16)
+    parity.add_argument("--tolerance", type=float, default=0.02)
+    parity.add_argument("--quantize", choices=["float16", "int8", "none"], default="float16",
+                        help="which exported TFLite model to check")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "tflite":
+        output = args.output or exported_model_path(MODEL_PATH, "tflite", args.quantize)
+        export_tflite(MODEL_PATH, output, args.quantize)
+        print(f"Wrote {output}")
+    elif args.command == "onnx":
+        output = args.output or exported_model_path(MODEL_PATH, "onnx")
+        export_onnx(MODEL_PATH, output, args.opset)
+        print(f"Wrote {output}")
+    else:
+        backends = [name.strip() for name in args.backends.split(",") if name.strip()]
+        reference = reference_set(args.reference_dir, args.samples)
+        return 0 if check_parity(backends, reference, args.tolerance, args.quantize) else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
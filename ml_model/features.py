@@ -0,0 +1,210 @@
+"""
+MFCC feature extraction and the worker pool it runs on
+Kept free of TensorFlow so pool workers stay small and start quickly
+"""
+import os
+import time
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+import mfcc as mfcc_engine
+from activity import apply_activity_gate
+from audio_io import AudioTooLongError, decode_audio, pcm16_to_signal
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Number of processes used for decoding and MFCC extraction. 0 runs extraction
+# on a thread pool inside the server process instead.
+FEATURE_WORKERS = int(os.getenv("FEATURE_WORKERS", str(os.cpu_count() or 1)))
+
+# "numpy" uses the cached-basis engine in mfcc.py, "librosa" the reference implementation
+MFCC_ENGINE = os.getenv("MFCC_ENGINE", "numpy").strip().lower()
+
+# Model input width in MFCC frames, and the step between windows in windowed mode
+WINDOW_FRAMES = 862
+WINDOW_HOP_FRAMES = int(os.getenv("WINDOW_HOP_FRAMES", "431"))
+
+
+def extract_features(y, sr, max_pad_len=862, timings=None):
+    """
+    Extract MFCC features from a decoded audio signal. When a timings dict is
+    given, seconds spent on "mfcc" and "padding" are recorded in it.
+    """
+    try:
+        started = time.perf_counter()
+        if MFCC_ENGINE != "librosa":
+            # Writes straight into the padded output, so there is no separate padding step
+            mfcc = mfcc_engine.mfcc(y, sr, max_frames=max_pad_len)
+            if timings is not None:
+                timings["mfcc"] = time.perf_counter() - started
+            return mfcc
+
+        import librosa
+        mfcc = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=40)
+        padding_started = time.perf_counter()
+        pad_width = max_pad_len - mfcc.shape[1]
+        if pad_width > 0:
+            mfcc = np.pad(mfcc, pad_width=((0, 0), (0, pad_width)), mode='constant')
+        else:
+            mfcc = mfcc[:, :max_pad_len]
+        if timings is not None:
+            timings["mfcc"] = padding_started - started
+            timings["padding"] = time.perf_counter() - padding_started
+        return mfcc
+    except Exception as e:
+        raise ValueError(f"Error processing audio file: {str(e)}")
+
+
+def decode_for_features(content, suffix=".wav", timings=None):
+    """
+    Decode uploaded bytes and apply the silence/activity gate. Returns the
+    signal, its sample rate and the seconds trimmed from its start.
+    """
+    started = time.perf_counter()
+    try:
+        y, sr = decode_audio(content, suffix)
+    except AudioTooLongError:
+        raise
+    except Exception as e:
+        raise ValueError(f"Error processing audio file: {str(e)}")
+    if timings is not None:
+        timings["decode"] = time.perf_counter() - started
+    y, offset = gate_signal(y, sr, timings)
+    return y, sr, offset
+
+
+def gate_signal(y, sr, timings=None):
+    """Silence trimming and activity check; returns the signal and seconds trimmed from its start"""
+    started = time.perf_counter()
+    # Raises NoActivityError before any MFCC work on an empty recording
+    y, offset = apply_activity_gate(y, sr)
+    if timings is not None:
+        timings["trim"] = time.perf_counter() - started
+    return y, offset
+
+
+def features_from_bytes(content, suffix=".wav"):
+    """Decode uploaded audio bytes and extract MFCC features"""
+    y, sr, _ = decode_for_features(content, suffix)
+    return extract_features(y, sr)
+
+
+def window_starts(total_frames, window_frames=WINDOW_FRAMES, hop_frames=WINDOW_HOP_FRAMES):
+    """Start frames of overlapping windows covering every frame of the recording"""
+    hop_frames = max(1, hop_frames)
+    if total_frames <= window_frames:
+        return [0]
+    starts = list(range(0, total_frames - window_frames + 1, hop_frames))
+    # Align a final window with the end so the tail isn't dropped
+    if starts[-1] + window_frames < total_frames:
+        starts.append(total_frames - window_frames)
+    return starts
+
+
+def extract_windowed_features(y, sr, window_frames=WINDOW_FRAMES, hop_frames=WINDOW_HOP_FRAMES, timings=None):
+    """
+    MFCC windows of shape (n_windows, 40, window_frames) plus their start times
+    in seconds. One STFT and one DCT cover the whole recording; windows are
+    slices of that result.
+    """
+    try:
+        started = time.perf_counter()
+        if MFCC_ENGINE != "librosa":
+            log_mel = mfcc_engine.log_mel_spectrogram(y, sr)
+            total = len(log_mel)
+            full = mfcc_engine.mfcc_from_log_mel(log_mel, max(total, window_frames))
+        else:
+            import librosa
+            full = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=40)
+            total = full.shape[1]
+            if total < window_frames:
+                full = np.pad(full, pad_width=((0, 0), (0, window_frames - total)), mode='constant')
+
+        # Slicing and padding into fixed-width windows counts as padding
+        padding_started = time.perf_counter()
+        starts = window_starts(total, window_frames, hop_frames)
+        windows = np.empty((len(starts), full.shape[0], window_frames), dtype=np.float32)
+        for i, start in enumerate(starts):
+            windows[i] = full[:, start:start + window_frames]
+        if timings is not None:
+            timings["mfcc"] = padding_started - started
+            timings["padding"] = time.perf_counter() - padding_started
+
+        frame_seconds = mfcc_engine.HOP_LENGTH / float(sr)
+        return windows, [start * frame_seconds for start in starts], window_frames * frame_seconds
+    except Exception as e:
+        raise ValueError(f"Error processing audio file: {str(e)}")
+
+
+def windowed_features_from_bytes(content, suffix=".wav"):
+    """Decode uploaded audio bytes and extract overlapping MFCC windows"""
+    return profiled_features_from_bytes(content, suffix, windowed=True)[0]
+
+
+def profiled_features_from_bytes(content, suffix=".wav", windowed=False):
+    """
+    Same as (windowed_)features_from_bytes, plus a dict of seconds spent in
+    decode, trim, mfcc and padding. Runs in the feature workers, so the timings
+    are returned with the result rather than recorded here.
+    """
+    timings = {}
+    y, sr, offset = decode_for_features(content, suffix, timings)
+    return _features_from_signal(y, sr, offset, windowed, timings), timings
+
+
+def profiled_features_from_pcm16(content, sample_rate, channels=1, windowed=False):
+    """profiled_features_from_bytes for headerless 16-bit PCM, which needs no decoder"""
+    timings = {}
+    started = time.perf_counter()
+    y, sr = pcm16_to_signal(content, sample_rate, channels)
+    timings["decode"] = time.perf_counter() - started
+    y, offset = gate_signal(y, sr, timings)
+    return _features_from_signal(y, sr, offset, windowed, timings), timings
+
+
+def _features_from_signal(y, sr, offset, windowed, timings):
+    if not windowed:
+        return extract_features(y, sr, timings=timings)
+
+    windows, starts, window_seconds = extract_windowed_features(y, sr, timings=timings)
+    # Window times refer to the uploaded recording, not the trimmed signal
+    return windows, [start + offset for start in starts], window_seconds
+
+
+def _warm_up_worker():
+    """Pool initializer: pay import, numba JIT and filterbank setup once per worker"""
+    sr = 22050
+    t = np.arange(sr, dtype=np.float32) / sr
+    extract_features(0.1 * np.sin(2 * np.pi * 440.0 * t), sr)
+
+
+def _worker_ready():
+    return os.getpid()
+
+
+def create_feature_pool(workers: int = FEATURE_WORKERS) -> Executor:
+    """Create the executor used for decoding and MFCC extraction"""
+    if workers <= 0:
+        return ThreadPoolExecutor(thread_name_prefix="features")
+    # Spawn rather than fork so workers never inherit TensorFlow runtime threads
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_warm_up_worker,
+    )
+
+
+async def warm_feature_pool(pool: Executor, workers: int = FEATURE_WORKERS):
+    """Start every pool worker now so the first requests don't pay for it"""
+    if not isinstance(pool, ProcessPoolExecutor):
+        return
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(
+        *[loop.run_in_executor(pool, _worker_ready) for _ in range(workers)]
+    )
+    logger.info(f"Feature pool ready with {workers} worker processes")
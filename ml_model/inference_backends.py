@@ -0,0 +1,229 @@
+"""
+Inference runtimes for the respiratory disease model
+Keras (full TensorFlow), TFLite and ONNX Runtime behind one predict interface
+"""
+import os
+import logging
+import threading
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Runtime used by the service: "keras", "tflite" or "onnx"
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "keras").strip().lower()
+
+# Exported model for the tflite/onnx runtimes. Defaults to the path
+# export_model.py writes next to MODEL_PATH.
+INFERENCE_MODEL_PATH = os.getenv("INFERENCE_MODEL_PATH", "").strip()
+
+# Keras runs through a tf.function with a fixed input signature instead of
+# model.predict; KERAS_XLA additionally compiles it with XLA.
+KERAS_COMPILE = os.getenv("KERAS_COMPILE", "true").strip().lower() in ("1", "true", "yes")
+KERAS_XLA = os.getenv("KERAS_XLA", "false").strip().lower() in ("1", "true", "yes")
+
+# Forward passes per batch size run at startup before serving traffic
+WARMUP_PASSES = int(os.getenv("WARMUP_PASSES", "2"))
+
+# Threads used inside one op and across independent ops (0 leaves the runtime
+# default, usually every core). serve.py lowers these per worker.
+INTRA_OP_THREADS = int(os.getenv("INFERENCE_INTRA_OP_THREADS", "0"))
+INTER_OP_THREADS = int(os.getenv("INFERENCE_INTER_OP_THREADS", "0"))
+
+INPUT_SHAPE = (40, 862, 1)
+
+
+def exported_model_path(model_path: str, backend: str, quantize: str = "float16") -> str:
+    """Default location of an exported model, e.g. model.float16.tflite or model.onnx"""
+    stem = os.path.splitext(model_path)[0]
+    if backend == "tflite":
+        return f"{stem}.{quantize}.tflite" if quantize != "none" else f"{stem}.tflite"
+    if backend == "onnx":
+        return f"{stem}.onnx"
+    return model_path
+
+
+class InferenceBackend:
+    """Runs one forward pass over a (batch, 40, 862, 1) float32 tensor"""
+
+    name = "base"
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def predict(self, features: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def warm_up_batch_sizes(self, max_batch_size: int):
+        return sorted({1, max(1, max_batch_size)})
+
+    def warm_up(self, passes: int = WARMUP_PASSES, max_batch_size: int = 1):
+        """Run dummy forward passes so tracing and allocation happen before real traffic"""
+        for batch_size in self.warm_up_batch_sizes(max_batch_size):
+            dummy = np.zeros((batch_size,) + INPUT_SHAPE, dtype=np.float32)
+            for _ in range(max(0, passes)):
+                self.predict(dummy)
+
+
+def configure_threads(intra_op: int, inter_op: int):
+    """Set runtime thread counts for backends loaded after this call"""
+    global INTRA_OP_THREADS, INTER_OP_THREADS
+    INTRA_OP_THREADS, INTER_OP_THREADS = intra_op, inter_op
+
+
+def _next_power_of_two(n: int) -> int:
+    return 1 << (max(1, n) - 1).bit_length()
+
+
+class KerasBackend(InferenceBackend):
+    name = "keras"
+
+    def __init__(self, path: str, compile: bool = KERAS_COMPILE, xla: bool = KERAS_XLA):
+        super().__init__(path)
+        import tensorflow as tf
+        try:
+            # Only possible before the TensorFlow runtime has started
+            if INTRA_OP_THREADS:
+                tf.config.threading.set_intra_op_parallelism_threads(INTRA_OP_THREADS)
+            if INTER_OP_THREADS:
+                tf.config.threading.set_inter_op_parallelism_threads(INTER_OP_THREADS)
+        except RuntimeError as e:
+            logger.warning(f"TensorFlow thread limits not applied: {str(e)}")
+        self.model = tf.keras.models.load_model(path)
+        self.xla = compile and xla
+        self._forward = None
+        if compile:
+            # A fixed signature means the graph is traced once, not per batch size
+            self._forward = tf.function(
+                lambda x: self.model(x, training=False),
+                input_signature=[tf.TensorSpec((None,) + INPUT_SHAPE, tf.float32)],
+                jit_compile=self.xla,
+            )
+
+    def predict(self, features: np.ndarray) -> np.ndarray:
+        if self._forward is None:
+            return self.model.predict(features, batch_size=len(features), verbose=0)
+
+        features = np.asarray(features, dtype=np.float32)
+        count = len(features)
+        if self.xla:
+            # XLA compiles per concrete shape; pad to power-of-two buckets so
+            # only a handful of programs are ever built
+            bucket = _next_power_of_two(count)
+            if bucket != count:
+                padding = np.zeros((bucket - count,) + features.shape[1:], dtype=np.float32)
+                features = np.concatenate([features, padding])
+        return self._forward(features).numpy()[:count]
+
+    def warm_up_batch_sizes(self, max_batch_size: int):
+        if not self.xla:
+            return super().warm_up_batch_sizes(max_batch_size)
+        sizes, size = [], 1
+        while size < _next_power_of_two(max_batch_size) * 2:
+            sizes.append(size)
+            size *= 2
+        return sizes
+
+
+class TFLiteBackend(InferenceBackend):
+    name = "tflite"
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            # Fall back to the interpreter bundled with full TensorFlow
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+        self.interpreter = Interpreter(model_path=path, num_threads=INTRA_OP_THREADS or os.cpu_count())
+        self.interpreter.allocate_tensors()
+        self.input_index = self.interpreter.get_input_details()[0]["index"]
+        self.output_index = self.interpreter.get_output_details()[0]["index"]
+        self._batch_size = None
+        # A TFLite interpreter must not be invoked from several threads at once
+        self._lock = threading.Lock()
+
+    def predict(self, features: np.ndarray) -> np.ndarray:
+        features = np.ascontiguousarray(features, dtype=np.float32)
+        with self._lock:
+            if self._batch_size != len(features):
+                self.interpreter.resize_tensor_input(self.input_index, list(features.shape))
+                self.interpreter.allocate_tensors()
+                self._batch_size = len(features)
+            self.interpreter.set_tensor(self.input_index, features)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self.output_index).copy()
+
+
+class OnnxBackend(InferenceBackend):
+    name = "onnx"
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        if INTRA_OP_THREADS:
+            options.intra_op_num_threads = INTRA_OP_THREADS
+        if INTER_OP_THREADS:
+            options.inter_op_num_threads = INTER_OP_THREADS
+        self.session = ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, features: np.ndarray) -> np.ndarray:
+        features = np.ascontiguousarray(features, dtype=np.float32)
+        return self.session.run(None, {self.input_name: features})[0]
+
+
+BACKENDS = {
+    KerasBackend.name: KerasBackend,
+    TFLiteBackend.name: TFLiteBackend,
+    OnnxBackend.name: OnnxBackend,
+}
+
+
+# Models loaded by a pre-fork parent (serve.py), keyed by runtime and file. Forked
+# workers pick these up instead of loading their own copy.
+_preloaded = {}
+
+
+def resolve_model_path(model_path: str, backend: str = INFERENCE_BACKEND,
+                       exported_path: str = INFERENCE_MODEL_PATH) -> str:
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown INFERENCE_BACKEND '{backend}', expected one of {', '.join(BACKENDS)}")
+    path = model_path if backend == "keras" else (exported_path or exported_model_path(model_path, backend))
+    if not os.path.exists(path):
+        hint = "" if backend == "keras" else f"; create it with `python export_model.py {backend}`"
+        raise FileNotFoundError(f"No {backend} model at {path}{hint}")
+    return os.path.abspath(path)
+
+
+def load_backend(model_path: str, backend: str = INFERENCE_BACKEND,
+                 exported_path: str = INFERENCE_MODEL_PATH) -> InferenceBackend:
+    """Load the model with the requested runtime"""
+    path = resolve_model_path(model_path, backend, exported_path)
+    # Handed out once, so a later reload of the same file reads it again
+    preloaded = _preloaded.pop((backend, path), None)
+    if preloaded is not None:
+        logger.info(f"Using {backend} model from {path} preloaded before fork")
+        return preloaded
+    logger.info(f"Loading {backend} model from {path}")
+    return BACKENDS[backend](path)
+
+
+def preload_backend(model_path: str, backend: str = INFERENCE_BACKEND,
+                    exported_path: str = INFERENCE_MODEL_PATH) -> InferenceBackend:
+    """Load a model in this process so that processes forked afterwards share it"""
+    model = load_backend(model_path, backend, exported_path)
+    _preloaded[(backend, resolve_model_path(model_path, backend, exported_path))] = model
+    return model
+
+
+def preloaded_backends():
+    return list(_preloaded.values())
+
+
+def discard_preloaded():
+    """Forget preloaded models, so every process loads its own"""
+    _preloaded.clear()
@@ -1,12 +1,53 @@
 import os
-import librosa
+import hmac
+import time
+import logging
 import numpy as np
-import tensorflow as tf
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-import tempfile
-import aiofiles
+import json
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel
+from activity import NoActivityError, config_tag as activity_config_tag
+from admission import (
+    AdmissionController,
+    AdmissionError,
+    AdmissionMiddleware,
+    AdmittedStreamingResponse,
+    ClientDisconnected,
+    Overloaded,
+    audio_seconds,
+    record_service,
+    run_guarded,
+)
+from audio_io import TARGET_SAMPLE_RATE, AudioTooLongError, is_archive_filename, is_audio_filename, read_archive
+from inference_backends import INFERENCE_BACKEND, INPUT_SHAPE
+from features import (
+    FEATURE_WORKERS,
+    MFCC_ENGINE,
+    WINDOW_HOP_FRAMES,
+    create_feature_pool,
+    profiled_features_from_bytes,
+    profiled_features_from_pcm16,
+    warm_feature_pool,
+)
+from metrics import (
+    CONTENT_TYPE,
+    STAGE_SECONDS,
+    Counter,
+    Gauge,
+    MetricsMiddleware,
+    executor_queue_depth,
+    render,
+)
+from model_registry import DEFAULT_ALIAS, ModelNotFoundError, ModelRegistry, registry_config
+from prediction_cache import PREDICTION_CACHE_DIR, PREDICTION_CACHE_SIZE, PredictionCache, content_hash
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
@@ -19,9 +60,27 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Load the model
+# Models are loaded in the background after the server starts listening, so
+# the port binds fast and feature pool workers (which re-import this module
+# when spawned) never load TensorFlow.
+# INFERENCE_BACKEND selects the runtime (see inference_backends.py) and
+# MODEL_REGISTRY serves several versions side by side (see model_registry.py).
 MODEL_PATH = os.getenv("MODEL_PATH", "prediction_lung_disease_model.keras")
-model = tf.keras.models.load_model(MODEL_PATH)
+
+# Name of the MODEL_PATH version when MODEL_REGISTRY is unset. Defaults to the file name.
+MODEL_VERSION = os.getenv("MODEL_VERSION", "").strip()
+
+# Required in X-Admin-Token for the /models management endpoints (empty disables them)
+MODEL_ADMIN_TOKEN = os.getenv("MODEL_ADMIN_TOKEN", "").strip()
+
+# Score long recordings as overlapping windows by default (per request: ?windowed=)
+WINDOWED_INFERENCE = os.getenv("WINDOWED_INFERENCE", "false").strip().lower() in ("1", "true", "yes")
+
+# Upper bound on recordings accepted by one /predict/batch request
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", "64"))
+
+# TensorFlow inference runs on its own executor, apart from feature extraction
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", "1"))
 
 # Default disease classes used by the trained model. Override with CLASS_LABELS env var
 # if your deployed model uses a different label order.
@@ -37,7 +96,10 @@ DEFAULT_CLASSES = [
 ]
 
 
-def resolve_class_labels(num_outputs: int):
+def resolve_class_labels(num_outputs: int, labels: Optional[List[str]] = None):
+    if labels and len(labels) == num_outputs:
+        return list(labels)
+
     env_labels = os.getenv("CLASS_LABELS", "").strip()
     if env_labels:
         labels = [label.strip() for label in env_labels.split(",") if label.strip()]
@@ -50,89 +112,678 @@ def resolve_class_labels(num_outputs: int):
     # Keep the API stable even if model classes and configured labels drift.
     return [f"class_{idx}" for idx in range(num_outputs)]
 
-def extract_features(file_path, max_pad_len=862):
-    """Extract MFCC features from audio file"""
+
+def format_prediction(probabilities, classes=None):
+    """Build the disease/confidence/predictions response for one output row"""
+    probabilities = np.asarray(probabilities).ravel()
+    if probabilities.size == 0:
+        raise ValueError("Model returned invalid prediction probabilities")
+
+    if classes is None or len(classes) != probabilities.size:
+        classes = resolve_class_labels(probabilities.size)
+    predicted_idx = int(np.argmax(probabilities))
+    predicted_class = classes[predicted_idx]
+    confidence = float(np.max(probabilities))
+
+    predictions_map = {
+        class_name: float(prob)
+        for class_name, prob in zip(classes, probabilities)
+    }
+
+    return {
+        "disease": predicted_class,
+        "confidence": confidence,
+        "predictions": predictions_map
+    }
+
+
+def format_windowed_prediction(probabilities, starts, window_seconds, classes=None):
+    """Aggregate per-window outputs: mean drives the top-level fields, plus max and a timeline"""
+    probabilities = np.asarray(probabilities).reshape(len(starts), -1)
+    result = format_prediction(probabilities.mean(axis=0), classes)
+    classes = list(result["predictions"])
+
+    timeline = []
+    for start, row in zip(starts, probabilities):
+        idx = int(np.argmax(row))
+        timeline.append({
+            "start": round(start, 3),
+            "end": round(start + window_seconds, 3),
+            "disease": classes[idx],
+            "confidence": float(row[idx]),
+            "predictions": {class_name: float(prob) for class_name, prob in zip(classes, row)},
+        })
+
+    result["windows"] = {
+        "count": len(starts),
+        "window_seconds": window_seconds,
+        "max": {class_name: float(prob) for class_name, prob in zip(classes, probabilities.max(axis=0))},
+        "timeline": timeline,
+    }
+    return result
+
+
+inference_executor = None
+feature_pool = None
+registry = None
+warm_up_task = None
+
+# Resubmitted recordings are answered from here without touching the model
+prediction_cache = PredictionCache(PREDICTION_CACHE_SIZE, PREDICTION_CACHE_DIR)
+
+# Cache misses are admitted only if they can finish before their deadline
+# (see admission.py); the rest are shed with 503 and Retry-After
+admission = AdmissionController()
+
+# Multipart forms are parsed before the handler runs, so the queue check for
+# those endpoints happens here, before the upload is received
+app.add_middleware(AdmissionMiddleware, controller=admission, paths=("/predict", "/predict/batch"))
+
+# Request counts, latency and in-flight gauges for the inference endpoints
+# (added last, so requests shed by the middleware above are counted too)
+app.add_middleware(MetricsMiddleware, paths=("/predict", "/predict/batch", "/predict/raw"))
+
+# Progress of the background load; /ready passes only once "ready" is set
+startup_state = {"ready": False, "phase": "starting", "error": None, "timings": {}}
+
+# Read at scrape time, so they cost nothing per request
+Gauge(
+    "ml_executor_queue_depth",
+    "Tasks waiting on the feature pool and inference executor",
+    ["executor"],
+    function=lambda: {
+        ("features",): executor_queue_depth(feature_pool),
+        ("inference",): executor_queue_depth(inference_executor),
+    },
+)
+Gauge(
+    "ml_batcher_queue_depth",
+    "Requests waiting for a batched forward pass, per model version",
+    ["model_version"],
+    function=lambda: {
+        (version,): entry.batcher.queue_depth for version, entry in (registry.entries if registry else {}).items()
+    },
+)
+Counter(
+    "ml_prediction_cache_lookups_total",
+    "Prediction cache lookups by result",
+    ["result"],
+    function=lambda: {
+        (result,): prediction_cache.stats()[result] for result in ("memory_hits", "disk_hits", "misses")
+    },
+)
+
+
+async def run_phase(name, awaitable):
+    """Await one startup phase, recording and logging how long it took"""
+    startup_state["phase"] = name
+    started = time.perf_counter()
+    result = await awaitable
+    elapsed = time.perf_counter() - started
+    startup_state["timings"][name] = round(elapsed, 3)
+    logger.info(f"Startup phase '{name}' finished in {elapsed:.2f}s")
+    return result
+
+
+async def load_models(config):
+    """Load and warm every configured version, then point the default alias"""
+    for version, spec in config["models"].items():
+        await registry.load(
+            version,
+            spec["path"],
+            spec.get("backend", INFERENCE_BACKEND),
+            spec.get("labels"),
+            spec.get("exported_path", ""),
+        )
+    registry.set_alias(DEFAULT_ALIAS, config[DEFAULT_ALIAS])
+
+
+async def load_and_warm_up():
+    """Load the models and prove they work before the service reports ready"""
     try:
-        y, sr = librosa.load(file_path, sr=None)
-        mfcc = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=40)
-        pad_width = max_pad_len - mfcc.shape[1]
-        if pad_width > 0:
-            mfcc = np.pad(mfcc, pad_width=((0, 0), (0, pad_width)), mode='constant')
-        else:
-            mfcc = mfcc[:, :max_pad_len]
-        return mfcc
+        config = registry_config(MODEL_PATH, MODEL_VERSION)
+        await run_phase("warm_feature_pool", warm_feature_pool(feature_pool, FEATURE_WORKERS))
+
+        # Each version runs warm-up inferences as it loads; at least one real
+        # inference per model has to succeed before the service is ready
+        await run_phase("load_models", load_models(config))
+
+        startup_state["phase"] = "ready"
+        startup_state["ready"] = True
+        logger.info(f"Model ready after {sum(startup_state['timings'].values()):.2f}s")
     except Exception as e:
-        raise ValueError(f"Error processing audio file: {str(e)}")
+        startup_state["phase"] = "failed"
+        startup_state["error"] = str(e)
+        logger.error(f"Model startup failed: {str(e)}")
+
+
+@app.on_event("startup")
+async def startup():
+    global inference_executor, feature_pool, registry, warm_up_task
+    feature_pool = create_feature_pool(FEATURE_WORKERS)
+
+    # Every model version gets its own batching queue on this executor
+    inference_executor = ThreadPoolExecutor(
+        max_workers=INFERENCE_THREADS, thread_name_prefix="inference"
+    )
+    registry = ModelRegistry(resolve_class_labels, inference_executor)
+
+    # Loading continues after the port is bound; /ready reports when it's done
+    warm_up_task = asyncio.create_task(load_and_warm_up())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    if warm_up_task is not None and not warm_up_task.done():
+        warm_up_task.cancel()
+    await registry.close()
+    inference_executor.shutdown(wait=False)
+    feature_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def require_ready():
+    """Refuse inference until the background warm-up has succeeded"""
+    if not startup_state["ready"]:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Model not ready ({startup_state['phase']})",
+            headers={"Retry-After": "5"},
+        )
+
+async def extract(content, filename, windowed=False):
+    """Decode and extract MFCC features (or MFCC windows) on the feature pool"""
+    suffix = os.path.splitext(filename)[1] or ".wav"
+    return await run_extractor(profiled_features_from_bytes, content, suffix, windowed)
+
+async def run_extractor(extractor, *args):
+    """Run a profiled extractor on the feature pool and record its stage timings"""
+    loop = asyncio.get_running_loop()
+    result, timings = await loop.run_in_executor(feature_pool, extractor, *args)
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.observe(seconds, stage)
+    record_service(sum(timings.values()))
+    return result
+
+def respond(result, entry, fingerprint):
+    """
+    Serialize here rather than in FastAPI so the cost shows up in the stage
+    metrics. X-Model-Fingerprint changes whenever the answer for the same input
+    could (model file, labels or preprocessing), even if the version name does not.
+    """
+    with STAGE_SECONDS.time("serialization"):
+        return JSONResponse(
+            content=result, headers={"X-Model-Version": entry.version, "X-Model-Fingerprint": fingerprint}
+        )
+
+def require_admin(token):
+    if not MODEL_ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Model management is disabled (MODEL_ADMIN_TOKEN is not set)")
+    if not token or not hmac.compare_digest(token, MODEL_ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+def unknown_model(e: ModelNotFoundError):
+    return HTTPException(status_code=404, detail=f"Unknown model version '{e.args[0]}'")
+
+def admission_error(e: AdmissionError):
+    if isinstance(e, Overloaded):
+        return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    if isinstance(e, ClientDisconnected):
+        # Nobody reads this; the status keeps abandoned requests apart in the metrics
+        return HTTPException(status_code=499, detail=str(e))
+    return HTTPException(status_code=504, detail=str(e))
+
+async def admitted(request, started, duration, work):
+    """
+    Run a request's cache-miss work under admission control. It is cancelled
+    if the client disconnects or the deadline (counted from `started`) passes.
+    """
+    budget = admission.deadline - (time.perf_counter() - started) if admission.deadline else None
+    try:
+        ticket = admission.admit(duration, budget)
+    except AdmissionError:
+        work.close()
+        raise
+    with ticket:
+        result = await run_guarded(request, work, budget)
+        ticket.complete()
+    return result
+
+def cache_version(entry, windowed):
+    """Results depend on the MFCC engine, windowing, resampling and silence trimming as well as the model"""
+    version = f"{entry.cache_version}:{MFCC_ENGINE}"
+    if TARGET_SAMPLE_RATE:
+        version += f"@{TARGET_SAMPLE_RATE}"
+    if activity_config_tag():
+        version += f"~{activity_config_tag()}"
+    return f"{version}+windowed-{WINDOW_HOP_FRAMES}" if windowed else version
+
+async def score_upload(entry, content, filename, windowed):
+    """Extract features on the feature pool and run them through the version's batcher"""
+    if windowed:
+        # All windows go through the model as one stacked batch
+        windows, starts, window_seconds = await extract(content, filename, windowed=True)
+        prediction = await entry.batcher.submit(windows[..., np.newaxis])
+        return format_windowed_prediction(prediction, starts, window_seconds, entry.labels)
+
+    # Decode and extract features from memory on the feature pool
+    features = await extract(content, filename)
+    features = np.expand_dims(features, axis=[0, -1])  # Add batch and channel dimensions
+
+    # Make prediction (batched with other in-flight requests)
+    prediction = await entry.batcher.submit(features)
+
+    if prediction is None or len(prediction) == 0:
+        raise ValueError("Model returned empty prediction output")
+    return format_prediction(prediction[0], entry.labels)
 
 @app.post("/predict")
-async def predict_disease(audio_file: UploadFile = File(...)):
+async def predict_disease(
+    request: Request,
+    audio_file: UploadFile = File(...),
+    windowed: Optional[bool] = None,
+    model_version: Optional[str] = None,
+):
     """
-    Endpoint to predict respiratory disease from audio file
+    Endpoint to predict respiratory disease from audio file.
+    model_version picks a loaded version or alias (default: the "default" alias).
     """
+    require_ready()
+    started = time.perf_counter()
+
     # Check file extension and mimetype
     filename = audio_file.filename.lower()
     if not (filename.endswith('.wav') or filename.endswith('.wave')):
         raise HTTPException(status_code=400, detail="Please upload a WAV file")
 
-    tmp_path = None
     try:
-        # Create temporary file
-        tmp_fd, tmp_path = tempfile.mkstemp(suffix='.wav')
-        os.close(tmp_fd)  # Close the file descriptor
+        # Checked again: the queue may have filled while the upload arrived
+        admission.check_queue()
+        with STAGE_SECONDS.time("upload_read"):
+            content = await audio_file.read()
 
-        # Save the uploaded file temporarily using async file operations
-        content = await audio_file.read()
-        async with aiofiles.open(tmp_path, 'wb') as tmp_file:
-            await tmp_file.write(content)
+        # The lease keeps this version alive until the request finishes, even
+        # if it is swapped out meanwhile
+        async with registry.acquire(model_version) as entry:
+            use_windows = WINDOWED_INFERENCE if windowed is None else windowed
+            fingerprint = cache_version(entry, use_windows)
+            cache_key = PredictionCache.key(content_hash(content), fingerprint)
+            cached = prediction_cache.get(cache_key)
+            if cached is not None:
+                return respond(cached, entry, fingerprint)
 
-        # Extract features (run in executor to avoid blocking)
-        loop = asyncio.get_running_loop()
-        features = await loop.run_in_executor(None, extract_features, tmp_path)
-        features = np.expand_dims(features, axis=[0, -1])  # Add batch and channel dimensions
+            result = await admitted(
+                request, started, audio_seconds(content), score_upload(entry, content, filename, use_windows)
+            )
+            prediction_cache.put(cache_key, result)
+            return respond(result, entry, fingerprint)
 
-        # Make prediction (run in executor to avoid blocking)
-        prediction = await loop.run_in_executor(None, lambda: model.predict(features, verbose=0))
+    except ModelNotFoundError as e:
+        raise unknown_model(e)
+    except AdmissionError as e:
+        raise admission_error(e)
+    except NoActivityError as e:
+        # Rejected before the model was invoked
+        raise HTTPException(status_code=422, detail=e.to_dict())
+    except AudioTooLongError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Error processing audio: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal error: {str(e)}")
 
-        if prediction is None or len(prediction) == 0:
-            raise ValueError("Model returned empty prediction output")
+RAW_DTYPES = {"float32": "<f4", "float16": "<f2"}
 
-        probabilities = np.asarray(prediction[0]).ravel()
-        if probabilities.size == 0:
-            raise ValueError("Model returned invalid prediction probabilities")
+def mfcc_from_body(body, dtype):
+    """Validate a raw (40, 862) little-endian MFCC tensor and shape it for the model"""
+    if dtype not in RAW_DTYPES:
+        raise ValueError(f"Unsupported X-Dtype '{dtype}', expected one of {', '.join(RAW_DTYPES)}")
+    expected = INPUT_SHAPE[0] * INPUT_SHAPE[1]
+    itemsize = np.dtype(RAW_DTYPES[dtype]).itemsize
+    if len(body) != expected * itemsize:
+        raise ValueError(
+            f"MFCC body must be {INPUT_SHAPE[0]}x{INPUT_SHAPE[1]} {dtype} values "
+            f"({expected * itemsize} bytes), got {len(body)} bytes"
+        )
+    features = np.frombuffer(body, dtype=RAW_DTYPES[dtype]).astype(np.float32)
+    if not np.isfinite(features).all():
+        raise ValueError("MFCC body contains NaN or infinite values")
+    return features.reshape((1,) + INPUT_SHAPE)
 
-        classes = resolve_class_labels(probabilities.size)
-        predicted_idx = int(np.argmax(probabilities))
-        predicted_class = classes[predicted_idx]
-        confidence = float(np.max(probabilities))
+async def score_pcm16(entry, body, sample_rate, channels, windowed):
+    features = await run_extractor(profiled_features_from_pcm16, body, sample_rate, channels, windowed)
+    if windowed:
+        windows, starts, window_seconds = features
+        prediction = await entry.batcher.submit(windows[..., np.newaxis])
+        return format_windowed_prediction(prediction, starts, window_seconds, entry.labels)
+    prediction = await entry.batcher.submit(np.expand_dims(features, axis=[0, -1]))
+    return format_prediction(prediction[0], entry.labels)
 
-        predictions_map = {
-            class_name: float(prob)
-            for class_name, prob in zip(classes, probabilities)
-        }
+async def score_mfcc(entry, features):
+    prediction = await entry.batcher.submit(features)
+    return format_prediction(prediction[0], entry.labels)
 
-        return {
-            "disease": predicted_class,
-            "confidence": confidence,
-            "predictions": predictions_map
-        }
+@app.post("/predict/raw")
+async def predict_raw(
+    request: Request,
+    x_input_kind: str = Header(...),
+    x_sample_rate: Optional[int] = Header(None),
+    x_channels: int = Header(1),
+    x_dtype: str = Header("float32"),
+    windowed: Optional[bool] = None,
+    model_version: Optional[str] = None,
+):
+    """
+    Predict from a compact binary body instead of a multipart WAV upload.
+    X-Input-Kind: pcm16 is headerless little-endian 16-bit PCM (X-Sample-Rate
+    required, X-Channels interleaved) and skips decoding. X-Input-Kind: mfcc is
+    a row-major (40, 862) float32/float16 tensor (X-Dtype) and goes straight
+    to the model. Responses match /predict.
+    """
+    require_ready()
+    started = time.perf_counter()
+    kind = x_input_kind.strip().lower()
+    if kind not in ("pcm16", "mfcc"):
+        raise HTTPException(status_code=400, detail="X-Input-Kind must be pcm16 or mfcc")
+    if kind == "pcm16" and not x_sample_rate:
+        raise HTTPException(status_code=400, detail="X-Sample-Rate is required for pcm16 input")
+
+    try:
+        # Shed load before reading the body
+        admission.check_queue()
+        with STAGE_SECONDS.time("upload_read"):
+            body = await request.body()
 
+        async with registry.acquire(model_version) as entry:
+            if kind == "mfcc":
+                # Already model input: no feature pool, no resampling or trimming
+                dtype = x_dtype.strip().lower()
+                fingerprint = f"{entry.cache_version}+mfcc-{dtype}"
+                cache_key = PredictionCache.key(content_hash(body), fingerprint)
+                cached = prediction_cache.get(cache_key)
+                if cached is not None:
+                    return respond(cached, entry, fingerprint)
+                features = mfcc_from_body(body, dtype)
+                result = await admitted(request, started, 0.0, score_mfcc(entry, features))
+                prediction_cache.put(cache_key, result)
+                return respond(result, entry, fingerprint)
+
+            use_windows = WINDOWED_INFERENCE if windowed is None else windowed
+            fingerprint = f"{cache_version(entry, use_windows)}+pcm16-{x_sample_rate}x{x_channels}"
+            cache_key = PredictionCache.key(content_hash(body), fingerprint)
+            cached = prediction_cache.get(cache_key)
+            if cached is not None:
+                return respond(cached, entry, fingerprint)
+
+            result = await admitted(
+                request, started, audio_seconds(body, x_sample_rate, x_channels),
+                score_pcm16(entry, body, x_sample_rate, x_channels, use_windows),
+            )
+            prediction_cache.put(cache_key, result)
+            return respond(result, entry, fingerprint)
+
+    except ModelNotFoundError as e:
+        raise unknown_model(e)
+    except AdmissionError as e:
+        raise admission_error(e)
+    except NoActivityError as e:
+        raise HTTPException(status_code=422, detail=e.to_dict())
+    except AudioTooLongError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Error processing input: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal error: {str(e)}")
+
+async def collect_batch_items(audio_files):
+    """Flatten uploaded WAVs and archives into (filename, bytes) pairs"""
+    items = []
+    for upload in audio_files:
+        filename = upload.filename or ""
+        with STAGE_SECONDS.time("upload_read"):
+            content = await upload.read()
+        if is_archive_filename(filename):
+            items.extend(read_archive(filename, content, MAX_BATCH_FILES - len(items)))
+        elif is_audio_filename(filename):
+            items.append((filename, content))
+        else:
+            raise ValueError(f"Unsupported file {filename}: upload WAV files or a zip/tar archive")
+        if len(items) > MAX_BATCH_FILES:
+            raise ValueError(f"At most {MAX_BATCH_FILES} recordings per batch")
+    if not items:
+        raise ValueError("No WAV recordings found in upload")
+    return items
+
+async def predict_batch_item(model, index, filename, content):
+    """Score one recording of a streamed batch through the version's batcher"""
+    entry = {"index": index, "filename": filename}
+    try:
+        cache_key = PredictionCache.key(content_hash(content), cache_version(model, False))
+        result = prediction_cache.get(cache_key)
+        if result is None:
+            features = await extract(content, filename)
+            prediction = await model.batcher.submit(np.expand_dims(features, axis=[0, -1]))
+            result = format_prediction(prediction[0], model.labels)
+            prediction_cache.put(cache_key, result)
+        entry.update(result)
+    except NoActivityError as e:
+        entry["error"] = str(e)
+        entry["error_code"] = "no_activity"
+    except Exception as e:
+        entry["error"] = str(e)
+    return entry
+
+async def stream_batch(items, version, ticket):
+    """
+    Yield NDJSON lines in completion order so early results arrive first. The
+    ticket is released by AdmittedStreamingResponse, also if this never starts.
+    """
+    ticket.activate()
+    async for line in _stream_batch(items, version):
+        yield line
+    ticket.complete()
+
+async def _stream_batch(items, version):
+    async with registry.acquire(version) as model:
+        tasks = [
+            asyncio.create_task(predict_batch_item(model, index, filename, content))
+            for index, (filename, content) in enumerate(items)
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield json.dumps(await next_done) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+@app.post("/predict/batch")
+async def predict_batch(
+    request: Request,
+    audio_files: List[UploadFile] = File(...),
+    stream: bool = False,
+    model_version: Optional[str] = None,
+):
+    """
+    Predict many recordings in one request. Accepts several WAV files or a
+    zip/tar archive; stream=true returns NDJSON lines as each result is ready.
+    """
+    require_ready()
+    started = time.perf_counter()
+    try:
+        version = registry.resolve(model_version).version
+        # Checked again: the queue may have filled while the upload arrived
+        admission.check_queue()
+    except ModelNotFoundError as e:
+        raise unknown_model(e)
+    except AdmissionError as e:
+        raise admission_error(e)
+    try:
+        items = await collect_batch_items(audio_files)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Error processing batch: {str(e)}")
+
+    # Admitted as a whole, costed by the total audio in the batch
+    duration = sum(audio_seconds(content) for _, content in items)
+    headers = {"X-Model-Version": version}
+    if stream:
+        # Results trickle out, so only the queue bound applies; a disconnect
+        # stops the stream and cancels what is left
+        try:
+            ticket = admission.admit(duration)
+        except AdmissionError as e:
+            raise admission_error(e)
+        return AdmittedStreamingResponse(
+            stream_batch(items, version, ticket), ticket, media_type="application/x-ndjson", headers=headers
+        )
+
+    try:
+        async with registry.acquire(version) as model:
+            results = await admitted(request, started, duration, score_batch(model, items))
+        with STAGE_SECONDS.time("serialization"):
+            return JSONResponse(content={"results": results}, headers=headers)
+
+    except ModelNotFoundError as e:
+        raise unknown_model(e)
+    except AdmissionError as e:
+        raise admission_error(e)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=f"Error processing audio: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal error: {str(e)}")
-    finally:
-        # Clean up temporary file
-        if tmp_path and os.path.exists(tmp_path):
-            try:
-                os.unlink(tmp_path)
-            except Exception:
-                pass  # Ignore cleanup errors
+
+async def score_batch(model, items):
+    """Answer cached recordings, then run every miss through one forward pass"""
+    results = [{"index": index, "filename": filename} for index, (filename, _) in enumerate(items)]
+    cache_keys = [
+        PredictionCache.key(content_hash(content), cache_version(model, False)) for _, content in items
+    ]
+
+    pending = []
+    for index, cache_key in enumerate(cache_keys):
+        cached = prediction_cache.get(cache_key)
+        if cached is not None:
+            results[index].update(cached)
+        else:
+            pending.append(index)
+
+    # Extract features for all misses in parallel, then run one forward pass
+    extracted = await asyncio.gather(
+        *[extract(items[index][1], items[index][0]) for index in pending],
+        return_exceptions=True,
+    )
+    ready = []
+    for index, features in zip(pending, extracted):
+        if isinstance(features, Exception):
+            results[index]["error"] = str(features)
+            if isinstance(features, NoActivityError):
+                results[index]["error_code"] = "no_activity"
+        else:
+            ready.append((index, features))
+
+    if ready:
+        batch = np.stack([features for _, features in ready])[..., np.newaxis]
+        prediction = await model.batcher.submit(batch)
+        for (index, _), row in zip(ready, prediction):
+            result = format_prediction(row, model.labels)
+            prediction_cache.put(cache_keys[index], result)
+            results[index].update(result)
+
+    return results
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {"status": "healthy"}
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness endpoint: passes only after the model has run a warm-up inference"""
+    body = {
+        "status": "ready" if startup_state["ready"] else "not_ready",
+        "phase": startup_state["phase"],
+        "timings": startup_state["timings"],
+        "admission": admission.stats(),
+    }
+    if startup_state["ready"]:
+        # What a plain /predict would answer with, so clients can tell when a
+        # stored result is still current (see respond)
+        body["model_fingerprint"] = cache_version(registry.resolve(), WINDOWED_INFERENCE)
+    if startup_state["error"]:
+        body["error"] = startup_state["error"]
+    return JSONResponse(status_code=200 if startup_state["ready"] else 503, content=body)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: per-stage latency histograms, request counters and queue gauges"""
+    return Response(content=render(), media_type=CONTENT_TYPE)
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Prediction cache hit/miss counters"""
+    default = registry.aliases.get(DEFAULT_ALIAS) if registry else None
+    return {"model_version": default, **prediction_cache.stats()}
+
+class ModelLoadRequest(BaseModel):
+    version: str
+    path: str
+    backend: str = INFERENCE_BACKEND
+    labels: Optional[List[str]] = None
+    exported_path: str = ""
+    alias: Optional[str] = None
+
+class AliasRequest(BaseModel):
+    version: str
+
+@app.get("/models")
+async def list_models():
+    """Loaded model versions, their labels and in-flight request counts, plus aliases"""
+    require_ready()
+    return registry.describe()
+
+@app.post("/models")
+async def load_model(request: ModelLoadRequest, x_admin_token: Optional[str] = Header(None)):
+    """
+    Load (or reload) a model version without restarting. Reusing an existing
+    version name swaps it atomically; requests already running finish on the
+    old model. Set alias to repoint e.g. "default" once the version is warm.
+    """
+    require_admin(x_admin_token)
+    require_ready()
+    try:
+        entry = await registry.load(
+            request.version, request.path, request.backend, request.labels, request.exported_path
+        )
+        if request.alias:
+            registry.set_alias(request.alias, entry.version)
+    except (FileNotFoundError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Error loading model: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal error: {str(e)}")
+    return entry.describe()
+
+@app.put("/models/aliases/{alias}")
+async def set_model_alias(alias: str, request: AliasRequest, x_admin_token: Optional[str] = Header(None)):
+    """Point an alias at a loaded version; the next request uses it"""
+    require_admin(x_admin_token)
+    require_ready()
+    try:
+        registry.set_alias(alias, request.version)
+    except ModelNotFoundError as e:
+        raise unknown_model(e)
+    return {"alias": alias, "version": request.version}
+
+@app.delete("/models/{version}")
+async def unload_model(version: str, x_admin_token: Optional[str] = Header(None)):
+    """Unload a version once no alias points at it; in-flight requests still finish"""
+    require_admin(x_admin_token)
+    require_ready()
+    try:
+        await registry.unload(version)
+    except ModelNotFoundError as e:
+        raise unknown_model(e)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"version": version, "status": "unloaded"}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
@@ -0,0 +1,211 @@
+"""
+Prometheus metrics for the inference service
+Counters, gauges and histograms rendered in the Prometheus text format on /metrics
+"""
+import time
+import bisect
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+# Seconds; spans sub-millisecond cache hits to multi-second long recordings
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_ROW_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+def _format_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield from self._samples()
+
+    def _samples(self):
+        raise NotImplementedError
+
+
+class _Value(Metric):
+    """
+    Single value per label set: updated in place, or read at scrape time from
+    `function` (returning a number or {label values tuple: number})
+    """
+
+    def __init__(self, name, documentation, labelnames=(), function: Optional[Callable] = None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def _samples(self):
+        if self.function is not None:
+            try:
+                result = self.function()
+            except Exception:
+                return
+            values = result if isinstance(result, dict) else {(): result}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        for labels, value in values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Counter(_Value):
+    kind = "counter"
+
+
+class Gauge(_Value):
+    kind = "gauge"
+
+    def set(self, value: float, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def dec(self, *labels, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [bucket counts..., +Inf count], sum
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def time(self, *labels):
+        """Context manager observing the elapsed time of its block"""
+        return _Timer(self, labels)
+
+    def _samples(self):
+        with self._lock:
+            values = {labels: (list(counts), total) for labels, (counts, total) in self._values.items()}
+        for labels, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+REGISTRY = []
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def executor_queue_depth(executor) -> int:
+    """Work items submitted to an executor but not yet picked up by a worker"""
+    if executor is None:
+        return 0
+    if isinstance(executor, ProcessPoolExecutor):
+        # Includes items a worker is currently running
+        return len(executor._pending_work_items)
+    return executor._work_queue.qsize()
+
+
+# Where request time goes. decode/trim/mfcc/padding are measured inside the feature
+# workers and reported back with the features.
+STAGE_SECONDS = Histogram(
+    "ml_stage_duration_seconds",
+    "Time spent in each request stage (upload_read, decode, trim, mfcc, padding, queue_wait, inference, serialization)",
+    ["stage"],
+)
+REQUEST_SECONDS = Histogram("ml_request_duration_seconds", "End-to-end request latency", ["endpoint"])
+REQUESTS = Counter("ml_requests_total", "Requests by endpoint and status code", ["endpoint", "status"])
+IN_FLIGHT = Gauge("ml_requests_in_flight", "Requests currently being handled", ["endpoint"])
+BATCH_ROWS = Histogram("ml_inference_batch_rows", "Rows per batched forward pass", buckets=BATCH_ROW_BUCKETS)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting requests, in-flight requests and latency for the
+    given paths; other paths pass straight through
+    """
+
+    def __init__(self, app, paths: Sequence[str]):
+        self.app = app
+        self.paths = frozenset(paths)
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path")
+        if scope["type"] != "http" or path not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        IN_FLIGHT.inc(path)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            IN_FLIGHT.dec(path)
+            REQUEST_SECONDS.observe(time.perf_counter() - started, path)
+            REQUESTS.inc(path, str(status["code"]))
@@ -0,0 +1,138 @@
+"""
+Vectorized NumPy MFCC engine
+Matches librosa.feature.mfcc defaults with the window, mel filterbank and DCT
+basis precomputed once per sample rate
+"""
+from functools import lru_cache
+from typing import Optional
+
+import numpy as np
+from scipy import fft as sp_fft
+
+# librosa.feature.mfcc defaults used by the trained model
+N_FFT = 2048
+HOP_LENGTH = 512
+N_MELS = 128
+N_MFCC = 40
+TOP_DB = 80.0
+AMIN = 1e-10
+
+# Frames transformed per STFT block, which bounds scratch memory on long recordings
+BLOCK_FRAMES = 256
+
+
+def _hz_to_mel(freqs):
+    """Slaney mel scale: linear below 1 kHz, logarithmic above"""
+    freqs = np.asanyarray(freqs, dtype=np.float64)
+    f_sp = 200.0 / 3
+    mels = freqs / f_sp
+    min_log_hz = 1000.0
+    min_log_mel = min_log_hz / f_sp
+    logstep = np.log(6.4) / 27.0
+    log_t = freqs >= min_log_hz
+    mels[log_t] = min_log_mel + np.log(freqs[log_t] / min_log_hz) / logstep
+    return mels
+
+
+def _mel_to_hz(mels):
+    mels = np.asanyarray(mels, dtype=np.float64)
+    f_sp = 200.0 / 3
+    freqs = f_sp * mels
+    min_log_hz = 1000.0
+    min_log_mel = min_log_hz / f_sp
+    logstep = np.log(6.4) / 27.0
+    log_t = mels >= min_log_mel
+    freqs[log_t] = min_log_hz * np.exp(logstep * (mels[log_t] - min_log_mel))
+    return freqs
+
+
+def mel_filterbank(sr: int, n_fft: int = N_FFT, n_mels: int = N_MELS) -> np.ndarray:
+    """Slaney-normalised triangular mel filters, shape (n_mels, n_fft // 2 + 1)"""
+    fftfreqs = np.fft.rfftfreq(n_fft, d=1.0 / sr)
+    min_mel, max_mel = _hz_to_mel(np.array([0.0, sr / 2.0]))
+    mel_f = _mel_to_hz(np.linspace(min_mel, max_mel, n_mels + 2))
+
+    fdiff = np.diff(mel_f)
+    ramps = np.subtract.outer(mel_f, fftfreqs)
+    lower = -ramps[:-2] / fdiff[:-1, None]
+    upper = ramps[2:] / fdiff[1:, None]
+    weights = np.maximum(0.0, np.minimum(lower, upper))
+
+    enorm = 2.0 / (mel_f[2:n_mels + 2] - mel_f[:n_mels])
+    weights *= enorm[:, None]
+    return weights.astype(np.float32)
+
+
+def dct_basis(n_mfcc: int = N_MFCC, n_mels: int = N_MELS) -> np.ndarray:
+    """Orthonormal DCT-II rows, shape (n_mfcc, n_mels)"""
+    k = np.arange(n_mfcc)[:, None]
+    n = np.arange(n_mels)[None, :]
+    basis = np.cos(np.pi * k * (2 * n + 1) / (2.0 * n_mels)) * np.sqrt(2.0 / n_mels)
+    basis[0] /= np.sqrt(2.0)
+    return basis.astype(np.float32)
+
+
+@lru_cache(maxsize=16)
+def _spectral_basis(sr: int, n_fft: int, n_mels: int):
+    """Periodic Hann window and transposed mel filterbank, cached per sample rate"""
+    window = (0.5 - 0.5 * np.cos(2.0 * np.pi * np.arange(n_fft) / n_fft)).astype(np.float32)
+    # Transposed once so the per-block projections are plain right-multiplies
+    return window, np.ascontiguousarray(mel_filterbank(sr, n_fft, n_mels).T)
+
+
+@lru_cache(maxsize=8)
+def _dct_basis(n_mfcc: int, n_mels: int) -> np.ndarray:
+    return dct_basis(n_mfcc, n_mels)
+
+
+def num_frames(num_samples: int, hop_length: int = HOP_LENGTH) -> int:
+    """STFT frame count for a centred transform of num_samples"""
+    return 1 + num_samples // hop_length
+
+
+def log_mel_spectrogram(y: np.ndarray, sr: int, n_fft: int = N_FFT, hop_length: int = HOP_LENGTH,
+                        n_mels: int = N_MELS) -> np.ndarray:
+    """
+    Power mel spectrogram in dB (librosa.power_to_db with ref=1.0, top_db=80),
+    shape (frames, n_mels). Computing this once lets callers take MFCCs of any
+    frame range without repeating the STFT.
+    """
+    window, mel_t = _spectral_basis(int(sr), n_fft, n_mels)
+    y = np.asarray(y, dtype=np.float32)
+    padded = np.pad(y, n_fft // 2, mode="constant")
+    frames = np.lib.stride_tricks.sliding_window_view(padded, n_fft)[::hop_length]
+
+    mel = np.empty((len(frames), n_mels), dtype=np.float32)
+    for start in range(0, len(frames), BLOCK_FRAMES):
+        block = frames[start:start + BLOCK_FRAMES] * window
+        spectrum = sp_fft.rfft(block, n=n_fft, axis=-1)
+        power = spectrum.real ** 2 + spectrum.imag ** 2
+        np.matmul(power, mel_t, out=mel[start:start + len(block)])
+
+    np.maximum(mel, AMIN, out=mel)
+    np.log10(mel, out=mel)
+    mel *= 10.0
+    np.maximum(mel, mel.max() - TOP_DB, out=mel)
+    return mel
+
+
+def mfcc_from_log_mel(log_mel: np.ndarray, max_frames: int, out: Optional[np.ndarray] = None,
+                      n_mfcc: int = N_MFCC) -> np.ndarray:
+    """
+    DCT the first max_frames rows of a (frames, n_mels) log-mel spectrogram into
+    an (n_mfcc, max_frames) matrix, zero padding short inputs
+    """
+    dct = _dct_basis(n_mfcc, log_mel.shape[1])
+    if out is None:
+        out = np.zeros((n_mfcc, max_frames), dtype=np.float32)
+    else:
+        out.fill(0.0)
+    used = min(max_frames, len(log_mel))
+    np.matmul(dct, log_mel[:used].T, out=out[:, :used])
+    return out
+
+
+def mfcc(y: np.ndarray, sr: int, max_frames: int = 862, out: Optional[np.ndarray] = None,
+         n_mfcc: int = N_MFCC) -> np.ndarray:
+    """MFCC matrix of shape (n_mfcc, max_frames), padded or truncated like extract_features"""
+    return mfcc_from_log_mel(log_mel_spectrogram(y, sr), max_frames, out=out, n_mfcc=n_mfcc)
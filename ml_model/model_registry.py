@@ -0,0 +1,219 @@
+"""
+Registry of loaded model versions
+Several versions can be served side by side; swaps are atomic and old versions
+are released only after their in-flight requests finish
+"""
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from batching import BATCH_MAX_SIZE, InferenceBatcher
+from inference_backends import (
+    INFERENCE_BACKEND,
+    INFERENCE_MODEL_PATH,
+    INPUT_SHAPE,
+    WARMUP_PASSES,
+    InferenceBackend,
+    load_backend,
+)
+from prediction_cache import model_file_version
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_ALIAS = "default"
+
+# JSON (inline or a path to a .json file) describing the versions to load at
+# startup, e.g. {"default": "v2", "models": {"v1": {"path": "v1.keras"},
+# "v2": {"path": "v2.keras", "backend": "tflite", "labels": ["Asthma", ...]}}}
+# When unset, MODEL_PATH is served as the only version, named MODEL_VERSION.
+MODEL_REGISTRY = os.getenv("MODEL_REGISTRY", "").strip()
+
+# Version names end up in prediction cache file names, so no path separators
+VERSION_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+
+
+def validate_version_name(version: str):
+    if not VERSION_NAME.match(version or ""):
+        raise ValueError(
+            f"Invalid model version name '{version}': use letters, digits, '.', '_' and '-'"
+        )
+
+
+class ModelNotFoundError(KeyError):
+    """Requested version or alias is not loaded"""
+
+
+class ModelEntry:
+    """One loaded model version with its own labels and batching queue"""
+
+    def __init__(self, version: str, backend: InferenceBackend, labels: List[str],
+                 batcher: InferenceBatcher, digest: str):
+        self.version = version
+        self.backend = backend
+        self.labels = labels
+        self.batcher = batcher
+        self.digest = digest
+        self.loaded_at = time.time()
+        self.refs = 0
+        self.retired = False
+
+    @property
+    def cache_version(self) -> str:
+        """Prediction cache namespace: version name, served file and label list"""
+        labels = hashlib.sha256(",".join(self.labels).encode("utf-8")).hexdigest()[:8]
+        return f"{self.version}.{self.digest}.{labels}"
+
+    def describe(self) -> dict:
+        return {
+            "version": self.version,
+            "backend": self.backend.name,
+            "path": self.backend.path,
+            "labels": self.labels,
+            "digest": self.digest,
+            "in_flight": self.refs,
+            "loaded_at": self.loaded_at,
+        }
+
+
+class ModelRegistry:
+    """Loads, aliases and reference-counts model versions"""
+
+    def __init__(self, label_resolver: Callable[[int, Optional[List[str]]], List[str]], executor=None):
+        self.label_resolver = label_resolver
+        self.executor = executor
+        self.entries: Dict[str, ModelEntry] = {}
+        self.aliases: Dict[str, str] = {}
+        # One load at a time, so a rollout never holds three copies in memory
+        self._load_lock = asyncio.Lock()
+
+    def resolve(self, name: Optional[str] = None) -> ModelEntry:
+        """Find the entry for a version or alias (the default alias when name is empty)"""
+        name = name or DEFAULT_ALIAS
+        version = self.aliases.get(name, name)
+        entry = self.entries.get(version)
+        if entry is None:
+            raise ModelNotFoundError(name)
+        return entry
+
+    @asynccontextmanager
+    async def acquire(self, name: Optional[str] = None):
+        """Lease an entry for the duration of a request"""
+        # No await between lookup and increment, so a concurrent swap can't
+        # retire the entry in between
+        entry = self.resolve(name)
+        entry.refs += 1
+        try:
+            yield entry
+        finally:
+            entry.refs -= 1
+            if entry.retired and entry.refs == 0:
+                await self._close(entry)
+
+    async def load(self, version: str, path: str, backend: str = INFERENCE_BACKEND,
+                   labels: Optional[List[str]] = None, exported_path: str = "") -> ModelEntry:
+        """
+        Load and warm a version, then install it atomically. An existing entry
+        with the same name keeps serving its in-flight requests until they finish.
+        """
+        validate_version_name(version)
+        async with self._load_lock:
+            loop = asyncio.get_running_loop()
+            started = time.perf_counter()
+            model = await loop.run_in_executor(self.executor, load_backend, path, backend, exported_path)
+            loaded = time.perf_counter()
+
+            # Trace (and XLA-compile) the forward pass before the version takes traffic
+            await loop.run_in_executor(self.executor, model.warm_up, max(1, WARMUP_PASSES), BATCH_MAX_SIZE)
+            probe = await loop.run_in_executor(
+                self.executor, model.predict, np.zeros((1,) + INPUT_SHAPE, dtype=np.float32)
+            )
+            num_outputs = int(np.asarray(probe).reshape(1, -1).shape[1])
+            if labels and len(labels) != num_outputs:
+                raise ValueError(
+                    f"Model version '{version}' has {num_outputs} outputs but {len(labels)} labels were given"
+                )
+            resolved_labels = self.label_resolver(num_outputs, labels)
+
+            digest = await loop.run_in_executor(None, model_file_version, model.path)
+            batcher = InferenceBatcher(model.predict, executor=self.executor)
+            await batcher.start()
+            entry = ModelEntry(version, model, resolved_labels, batcher, digest)
+
+            # Requests resolve versions without awaiting, so they see either the
+            # old entry or the new one, never a half-installed state
+            previous = self.entries.get(version)
+            self.entries[version] = entry
+            if previous is not None:
+                await self._retire(previous)
+
+        logger.info(
+            f"Model version '{version}' ({model.name}) loaded in {loaded - started:.2f}s, "
+            f"warmed up in {time.perf_counter() - loaded:.2f}s"
+        )
+        return entry
+
+    def set_alias(self, alias: str, version: str):
+        """Point an alias at a loaded version; takes effect for the next request"""
+        if version not in self.entries:
+            raise ModelNotFoundError(version)
+        self.aliases[alias] = version
+        logger.info(f"Alias '{alias}' -> '{version}'")
+
+    async def unload(self, version: str):
+        """Remove a version that no alias points at"""
+        if version not in self.entries:
+            raise ModelNotFoundError(version)
+        in_use = [alias for alias, target in self.aliases.items() if target == version]
+        if in_use:
+            raise ValueError(f"Version '{version}' is still the target of alias(es): {', '.join(in_use)}")
+        await self._retire(self.entries.pop(version))
+
+    async def _retire(self, entry: ModelEntry):
+        entry.retired = True
+        if entry.refs == 0:
+            await self._close(entry)
+
+    async def _close(self, entry: ModelEntry):
+        await entry.batcher.stop()
+        logger.info(f"Released model version '{entry.version}' ({entry.backend.path})")
+
+    async def close(self):
+        for entry in list(self.entries.values()):
+            await entry.batcher.stop()
+        self.entries.clear()
+        self.aliases.clear()
+
+    def describe(self) -> dict:
+        return {
+            "aliases": dict(self.aliases),
+            "models": {version: entry.describe() for version, entry in self.entries.items()},
+        }
+
+
+def registry_config(model_path: str, model_version: str = "") -> dict:
+    """Startup configuration from MODEL_REGISTRY, or MODEL_PATH as the only version"""
+    if not MODEL_REGISTRY:
+        version = model_version or re.sub(r"[^A-Za-z0-9._-]", "-", os.path.splitext(os.path.basename(model_path))[0])
+        return {
+            DEFAULT_ALIAS: version,
+            "models": {version: {"path": model_path, "exported_path": INFERENCE_MODEL_PATH}},
+        }
+
+    if MODEL_REGISTRY.startswith("{"):
+        config = json.loads(MODEL_REGISTRY)
+    else:
+        with open(MODEL_REGISTRY, "r") as f:
+            config = json.load(f)
+    if not config.get("models"):
+        raise ValueError("MODEL_REGISTRY must define at least one model")
+    config.setdefault(DEFAULT_ALIAS, next(iter(config["models"])))
+    return config
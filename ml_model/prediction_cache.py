@@ -0,0 +1,140 @@
+"""
+Prediction cache keyed by audio content and model version
+Bounded in-memory LRU tier with an optional on-disk tier behind it
+"""
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Entries kept in memory (0 disables the cache) and directory for the disk tier
+# (empty disables it)
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "1024"))
+PREDICTION_CACHE_DIR = os.getenv("PREDICTION_CACHE_DIR", "").strip()
+
+
+def content_hash(content: bytes) -> str:
+    """SHA-256 of the raw upload bytes"""
+    return hashlib.sha256(content).hexdigest()
+
+
+def model_file_version(path: str) -> str:
+    """Short digest of the model file, used as the default model version"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+class PredictionCache:
+    """Two-tier cache of prediction responses"""
+
+    def __init__(self, max_entries: int = PREDICTION_CACHE_SIZE, cache_dir: Optional[str] = None):
+        self.max_entries = max(0, max_entries)
+        self.cache_dir = cache_dir or None
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def key(content_digest: str, model_version: str) -> str:
+        return f"{model_version}-{content_digest}"
+
+    def _disk_path(self, key: str) -> str:
+        # Shard by the first bytes of the content hash to keep directories small
+        digest = key.rsplit("-", 1)[-1]
+        return os.path.join(self.cache_dir, digest[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[dict]:
+        """Look up a cached response, promoting disk hits into memory"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return result
+
+        if self.cache_dir:
+            try:
+                with open(self._disk_path(key), "r") as f:
+                    result = json.load(f)
+            except FileNotFoundError:
+                result = None
+            except Exception as e:
+                logger.warning(f"Unreadable prediction cache entry {key}: {str(e)}")
+                result = None
+            if result is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                self._remember(key, result)
+                return result
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, result: dict):
+        """Store a response in memory and, if configured, on disk"""
+        if not self.enabled:
+            return
+        self._remember(key, result)
+        if self.cache_dir:
+            try:
+                self._write_disk(key, result)
+            except Exception as e:
+                logger.warning(f"Failed to persist prediction cache entry {key}: {str(e)}")
+
+    def _remember(self, key: str, result: dict):
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _write_disk(self, key: str, result: dict):
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so readers never see a partial entry
+        tmp_fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(tmp_fd, "w") as f:
+                json.dump(result, f)
+            os.replace(tmp_path, path)
+        except Exception:
+            try:
+                os.unlink(tmp_path)
+            except Exception:
+                pass  # Ignore cleanup errors
+            raise
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "disk_tier": bool(self.cache_dir),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
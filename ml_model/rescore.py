@@ -0,0 +1,277 @@
+"""
+Offline bulk re-scoring of stored recordings with the current model
+Features are extracted on a process pool and scored in large batches in-process,
+with no HTTP in between. Progress is checkpointed to the output JSONL file, so an
+interrupted run picks up where it stopped.
+
+    python rescore.py dir ../backend/uploads --output rescore.jsonl
+    python rescore.py mongo --query '{"analysis_type": "file"}' --write-back
+    python rescore.py mongo --write-back --promote    # also replace the stored result
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+from datetime import datetime
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+
+from audio_io import is_audio_filename
+from features import FEATURE_WORKERS, create_feature_pool, features_from_bytes, windowed_features_from_bytes
+from inference_backends import INFERENCE_BACKEND, load_backend
+from prediction_cache import model_file_version
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MODEL_PATH = os.getenv("MODEL_PATH", "prediction_lung_disease_model.keras")
+MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
+MONGODB_DATABASE = os.getenv("MONGODB_DATABASE", "healthcare_db")
+
+# Analysis records store paths relative to the backend's working directory
+BACKEND_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+
+
+def scan_directory(root: str) -> Iterator[Tuple[str, str]]:
+    """(id, path) for every WAV under root, in a stable order so resumes line up"""
+    for directory, subdirs, files in os.walk(root):
+        subdirs.sort()
+        for name in sorted(files):
+            if is_audio_filename(name):
+                path = os.path.join(directory, name)
+                yield os.path.relpath(path, root), path
+
+
+def scan_mongo(collection, query: dict, root: str) -> Iterator[Tuple[str, str]]:
+    """(id, path) for every analysis record matching query that has a recording"""
+    query = {"$and": [query, {"file_path": {"$exists": True, "$ne": ""}}]}
+    for doc in collection.find(query, {"id": 1, "file_path": 1}).sort("_id", 1):
+        record_id = doc.get("id") or str(doc["_id"])
+        path = doc["file_path"]
+        yield record_id, path if os.path.isabs(path) else os.path.join(root, path)
+
+
+def load_checkpoint(output: str, retry_errors: bool, model_version: str) -> set:
+    """
+    Ids already scored by model_version in the output file. Results of other
+    versions stay in the file but do not count, so the same command rescores
+    everything after a model update.
+    """
+    done = set()
+    if not os.path.exists(output):
+        return done
+    with open(output, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Torn final line from an interrupted run
+            if record.get("model_version") != model_version:
+                continue
+            if retry_errors and "error" in record:
+                continue
+            done.add(record["id"])
+    return done
+
+
+def features_from_path(path: str, windowed: bool):
+    """Runs in a pool worker, so only the path crosses the process boundary"""
+    with open(path, "rb") as f:
+        content = f.read()
+    suffix = os.path.splitext(path)[1] or ".wav"
+    return (windowed_features_from_bytes if windowed else features_from_bytes)(content, suffix)
+
+
+def chunked(items: Iterator, size: int):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Rescorer:
+    """Extracts the next chunk's features while the current chunk runs through the model"""
+
+    def __init__(self, model, model_version: str, pool, windowed: bool):
+        # Imported here so feature pool workers (which import this module) stay light
+        from main import format_prediction, format_windowed_prediction, resolve_class_labels
+
+        self.model = model
+        self.model_version = model_version
+        self.pool = pool
+        self.windowed = windowed
+        self.format_prediction = format_prediction
+        self.format_windowed_prediction = format_windowed_prediction
+        self.resolve_class_labels = resolve_class_labels
+
+    def submit(self, chunk):
+        return [(record_id, path, self.pool.submit(features_from_path, path, self.windowed))
+                for record_id, path in chunk]
+
+    def score(self, submitted):
+        """Wait for a chunk's features, run one forward pass and build result records"""
+        records, ready = [], []
+        for record_id, path, future in submitted:
+            record = {"id": record_id, "path": path, "model_version": self.model_version}
+            try:
+                ready.append((record, future.result()))
+            except Exception as e:
+                record["error"] = str(e)
+            records.append(record)
+
+        if ready:
+            if self.windowed:
+                batch = np.concatenate([windows for _, (windows, _, _) in ready])[..., np.newaxis]
+            else:
+                batch = np.stack([features for _, features in ready])[..., np.newaxis]
+            outputs = np.asarray(self.model.predict(batch))
+            labels = self.resolve_class_labels(outputs.shape[1])
+
+            offset = 0
+            for record, features in ready:
+                if self.windowed:
+                    windows, starts, window_seconds = features
+                    rows = outputs[offset:offset + len(windows)]
+                    offset += len(windows)
+                    record["result"] = self.format_windowed_prediction(rows, starts, window_seconds, labels)
+                else:
+                    record["result"] = self.format_prediction(outputs[offset], labels)
+                    offset += 1
+        return records
+
+
+def record_filter(record_id: str) -> dict:
+    """Records without an application id were listed by their ObjectId"""
+    from bson import ObjectId
+
+    if ObjectId.is_valid(record_id):
+        return {"_id": ObjectId(record_id)}
+    return {"id": record_id}
+
+
+def write_back(collection, records, model_version: str, promote: bool):
+    """One unordered bulk write per chunk"""
+    from pymongo import UpdateOne
+
+    field = "rescores." + model_version.replace(".", "_")
+    scored_at = datetime.utcnow().isoformat()
+    operations = []
+    for record in records:
+        if "result" not in record:
+            continue
+        update = {field: {**record["result"], "scored_at": scored_at}}
+        if promote:
+            update.update({
+                "disease_type": record["result"]["disease"],
+                "confidence": record["result"]["confidence"],
+                "ml_result": record["result"],
+                "model_version": model_version,
+            })
+        operations.append(UpdateOne(record_filter(record["id"]), {"$set": update}))
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+
+
+def run(args) -> int:
+    collection = None
+    if args.source == "mongo":
+        from pymongo import MongoClient
+
+        collection = MongoClient(args.mongo_url)[args.database].analysis
+        items = scan_mongo(collection, json.loads(args.query), args.root)
+    else:
+        items = scan_directory(args.path)
+
+    model = load_backend(args.model_path, args.backend)
+    model_version = args.model_version or model_file_version(model.path)
+
+    if args.restart and os.path.exists(args.output):
+        os.remove(args.output)
+    done = load_checkpoint(args.output, args.retry_errors, model_version)
+    if done:
+        logger.info(f"Resuming: {len(done)} recordings already scored by {model_version} in {args.output}")
+    pending = (item for item in items if item[0] not in done)
+
+    pool = create_feature_pool(args.workers)
+    rescorer = Rescorer(model, model_version, pool, args.windowed)
+
+    scored = errors = 0
+    started = time.perf_counter()
+    try:
+        with open(args.output, "a") as output:
+            previous = None
+            for chunk in chunked(pending, args.batch_size):
+                current = rescorer.submit(chunk)
+                if previous is not None:
+                    scored, errors = _finish(rescorer, previous, output, collection, args, scored, errors, started)
+                previous = current
+            if previous is not None:
+                scored, errors = _finish(rescorer, previous, output, collection, args, scored, errors, started)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    logger.info(f"Done: {scored} scored, {errors} failed in {time.perf_counter() - started:.1f}s "
+                f"(model version {model_version})")
+    return 0 if not errors else 2
+
+
+def _finish(rescorer, submitted, output, collection, args, scored, errors, started):
+    records = rescorer.score(submitted)
+    if collection is not None and args.write_back:
+        write_back(collection, records, rescorer.model_version, args.promote)
+    # The checkpoint only advances once results are durable
+    for record in records:
+        output.write(json.dumps(record) + "\n")
+    output.flush()
+    os.fsync(output.fileno())
+
+    failed = sum(1 for record in records if "error" in record)
+    scored += len(records) - failed
+    errors += failed
+    elapsed = time.perf_counter() - started
+    logger.info(f"{scored + errors} recordings ({scored / elapsed:.1f}/s), {errors} failed")
+    return scored, errors
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="source", required=True)
+
+    directory = sub.add_parser("dir", help="score every WAV under a directory")
+    directory.add_argument("path")
+
+    mongo = sub.add_parser("mongo", help="score the recordings of analysis records")
+    mongo.add_argument("--query", default="{}", help="JSON filter on the analysis collection")
+    mongo.add_argument("--mongo-url", default=MONGODB_URL)
+    mongo.add_argument("--database", default=MONGODB_DATABASE)
+    mongo.add_argument("--root", default=BACKEND_ROOT, help="directory relative file_path values resolve against")
+    mongo.add_argument("--write-back", action="store_true", help="store results under rescores.<model_version>")
+    mongo.add_argument("--promote", action="store_true",
+                       help="with --write-back, also replace disease_type, confidence and ml_result")
+
+    for command in (directory, mongo):
+        command.add_argument("--output", default="rescore.jsonl", help="results and checkpoint (JSON lines)")
+        command.add_argument("--restart", action="store_true", help="ignore the existing checkpoint")
+        command.add_argument("--retry-errors", action="store_true", help="rescore recordings that failed before")
+        command.add_argument("--batch-size", type=int, default=64, help="recordings per forward pass")
+        command.add_argument("--workers", type=int, default=FEATURE_WORKERS, help="feature extraction processes")
+        command.add_argument("--model-path", default=MODEL_PATH)
+        command.add_argument("--backend", default=INFERENCE_BACKEND)
+        command.add_argument("--model-version", default="", help="defaults to a digest of the model file")
+        command.add_argument("--windowed", action="store_true", help="score overlapping windows, like ?windowed=true")
+
+    args = parser.parse_args(argv)
+    if args.source == "dir":
+        args.write_back = args.promote = False
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
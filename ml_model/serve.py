@@ -0,0 +1,233 @@
+"""
+Pre-fork multi-worker server
+The parent binds the port and, for TFLite and ONNX models, loads the model
+once before forking workers that share its read-only pages copy-on-write.
+Keras workers each load their own copy.
+Each worker is pinned to its own cores with matching inference thread limits.
+
+    python serve.py --workers 4
+    INFERENCE_BACKEND=tflite python serve.py --workers 8 --port 8001
+"""
+import os
+import gc
+import sys
+import time
+import signal
+import socket
+import logging
+import argparse
+from typing import Dict, List
+
+import numpy as np
+import uvicorn
+
+import main
+from inference_backends import (
+    INFERENCE_BACKEND,
+    INPUT_SHAPE,
+    configure_threads,
+    discard_preloaded,
+    preload_backend,
+    preloaded_backends,
+)
+from model_registry import registry_config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Backends that can be loaded before fork when built single-threaded. Thread
+# pools started before fork() do not exist in the children, and TensorFlow
+# starts its own regardless, so Keras workers load their own copy.
+FORK_SAFE_BACKENDS = ("tflite", "onnx")
+
+
+def core_slices(workers: int) -> List[List[int]]:
+    """Split the cores this process may use into one contiguous slice per worker"""
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    if workers >= len(cores):
+        return [[cores[index % len(cores)]] for index in range(workers)]
+    size = len(cores) // workers
+    return [cores[index * size:(index + 1) * size] for index in range(workers)]
+
+
+def bind_socket(host: str, port: int, backlog: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def preload_models(preload: str, intra_op: int):
+    """
+    Load configured models in the parent so forked workers share them. They are
+    built single-threaded, so no runtime thread pool exists yet at fork(). In
+    auto mode that only happens when workers get one intra-op thread anyway;
+    otherwise each worker builds its own after fork (a TFLite model is mapped
+    from its file, so its weights are still shared through the page cache).
+    """
+    config = registry_config(main.MODEL_PATH, main.MODEL_VERSION)
+    configure_threads(1, 1)
+    for version, spec in config["models"].items():
+        backend = spec.get("backend", INFERENCE_BACKEND)
+        if preload == "never" or (preload == "auto" and (backend not in FORK_SAFE_BACKENDS or intra_op > 1)):
+            logger.info(f"Model version '{version}' ({backend}) will be loaded by each worker")
+            continue
+        if intra_op > 1:
+            logger.warning(f"Model version '{version}' is preloaded single-threaded; "
+                           f"workers run it on 1 intra-op thread instead of {intra_op}")
+        started = time.perf_counter()
+        preload_backend(spec["path"], backend, spec.get("exported_path", ""))
+        logger.info(f"Preloaded model version '{version}' ({backend}) in {time.perf_counter() - started:.2f}s")
+
+
+def check_preloaded_after_fork(timeout: float) -> bool:
+    """
+    Run a forward pass of every preloaded model in a forked child, as a worker
+    would. If the child fails or hangs, the preloaded models are dropped and
+    each worker loads its own.
+    """
+    models = preloaded_backends()
+    if not models:
+        return True
+
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            for model in models:
+                model.predict(np.zeros((1,) + INPUT_SHAPE, dtype=np.float32))
+        except BaseException as e:
+            logger.error(f"Preloaded model failed after fork: {str(e)}")
+            code = 1
+        os._exit(code)
+
+    deadline = time.monotonic() + timeout
+    while True:
+        done, status = os.waitpid(pid, os.WNOHANG)
+        if done:
+            if os.waitstatus_to_exitcode(status) == 0:
+                logger.info("Preloaded models run correctly in a forked process")
+                return True
+            break
+        if time.monotonic() >= deadline:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            logger.error(f"Preloaded models did not answer within {timeout:.0f}s after fork")
+            break
+        time.sleep(0.05)
+
+    logger.warning("Discarding preloaded models; each worker will load its own")
+    discard_preloaded()
+    return False
+
+
+def run_worker(sock: socket.socket, cores: List[int], args):
+    """Body of a forked worker; never returns"""
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    logger.info(f"Worker {os.getpid()} serving on cores {cores}")
+
+    # Parent signal handlers must not run in the worker; uvicorn installs its own
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    config = uvicorn.Config(main.app, log_level=args.log_level, timeout_keep_alive=args.keep_alive)
+    server = uvicorn.Server(config)
+    try:
+        server.run(sockets=[sock])
+    finally:
+        os._exit(0)
+
+
+def main_loop(args) -> int:
+    slices = core_slices(args.workers)
+    intra_op = args.intra_op_threads or len(slices[0])
+    # Workers already give process-level parallelism; extra feature processes
+    # per worker would oversubscribe the cores they are pinned to
+    if "FEATURE_WORKERS" not in os.environ:
+        main.FEATURE_WORKERS = 0
+
+    sock = bind_socket(args.host, args.port, args.backlog)
+    preload_models(args.preload, intra_op)
+    check_preloaded_after_fork(args.fork_check_timeout)
+    # Applies to models the workers load themselves
+    configure_threads(intra_op, args.inter_op_threads)
+    # Keep the collector from touching (and so copying) objects shared with workers
+    gc.collect()
+    gc.freeze()
+
+    workers: Dict[int, int] = {}
+    stopping = False
+
+    def spawn(index: int):
+        pid = os.fork()
+        if pid == 0:
+            run_worker(sock, slices[index] if args.affinity else [], args)
+        workers[pid] = index
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    logger.info(f"Starting {args.workers} workers on {args.host}:{args.port} "
+                f"({intra_op} intra-op / {args.inter_op_threads or 'default'} inter-op threads each)")
+    for index in range(args.workers):
+        spawn(index)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        index = workers.pop(pid, None)
+        if index is None or stopping:
+            continue
+        logger.warning(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, restarting")
+        time.sleep(1)
+        spawn(index)
+
+    sock.close()
+    logger.info("All workers stopped")
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("ML_WORKERS", str(os.cpu_count() or 1))))
+    parser.add_argument("--intra-op-threads", type=int, default=int(os.getenv("INFERENCE_INTRA_OP_THREADS", "0")),
+                        help="threads per op in each worker (default: the worker's share of cores)")
+    parser.add_argument("--inter-op-threads", type=int, default=int(os.getenv("INFERENCE_INTER_OP_THREADS", "1")))
+    parser.add_argument("--no-affinity", dest="affinity", action="store_false",
+                        help="do not pin workers to CPU cores")
+    parser.add_argument("--preload", choices=["auto", "always", "never"], default="auto",
+                        help="load models in the parent before forking "
+                             "(auto: TFLite and ONNX, when workers get one intra-op thread)")
+    parser.add_argument("--fork-check-timeout", type=float, default=60,
+                        help="seconds a forked probe may take to run the preloaded models")
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--keep-alive", type=int, default=5)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args(argv)
+    args.workers = max(1, args.workers)
+    return args
+
+
+if __name__ == "__main__":
+    if not hasattr(os, "fork"):
+        sys.exit("serve.py needs fork(); use `python main.py` on this platform")
+    sys.exit(main_loop(parse_args()))
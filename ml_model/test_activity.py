@@ -0,0 +1,55 @@
+"""
+Tests for the silence/activity gate: active time is measured over the whole
+signal, so short recordings that are active throughout are never rejected
+
+    python -m pytest test_activity.py
+"""
+import numpy as np
+import pytest
+
+import activity
+from activity import NoActivityError, apply_activity_gate
+
+
+@pytest.fixture
+def gate(monkeypatch):
+    monkeypatch.setattr(activity, "REJECT_SILENT_AUDIO", True)
+    monkeypatch.setattr(activity, "ACTIVITY_MIN_DBFS", -60.0)
+    monkeypatch.setattr(activity, "ACTIVITY_MIN_SECONDS", 0.5)
+
+
+def noise(seconds, sr, level=0.3):
+    return (level * np.random.default_rng(0).standard_normal(int(seconds * sr))).astype(np.float32)
+
+
+@pytest.mark.parametrize("sr", [4000, 8000, 16000, 22050, 44100])
+@pytest.mark.parametrize("seconds", [0.5, 0.6, 1.0, 1.3])
+def test_clip_active_for_its_whole_length_is_accepted(gate, sr, seconds):
+    y = noise(seconds, sr)
+    trimmed, offset = apply_activity_gate(y, sr)
+    assert len(trimmed) == len(y)
+    assert offset == 0.0
+
+
+def test_short_burst_in_silence_is_rejected(gate):
+    sr = 8000
+    y = np.zeros(sr * 3, dtype=np.float32)
+    y[sr:sr + sr // 5] = noise(0.2, sr)
+    with pytest.raises(NoActivityError) as raised:
+        apply_activity_gate(y, sr)
+    assert 0.2 <= raised.value.active_seconds < 0.5
+
+
+def test_silent_recording_is_rejected(gate):
+    with pytest.raises(NoActivityError):
+        apply_activity_gate(np.zeros(8000, dtype=np.float32), 8000)
+
+
+def test_trim_keeps_the_active_tail(monkeypatch):
+    monkeypatch.setattr(activity, "SILENCE_TRIM", True)
+    sr = 8000
+    y = np.zeros(sr * 2, dtype=np.float32)
+    y[-sr // 2:] = noise(0.5, sr)
+    trimmed, offset = apply_activity_gate(y, sr)
+    assert offset > 1.0
+    assert len(trimmed) == len(y) - int(round(offset * sr))
@@ -0,0 +1,105 @@
+"""
+Tests for admission control: tickets of streamed responses are always
+released, and the learned cost excludes time spent queueing
+
+    python -m pytest test_admission.py
+"""
+import gc
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionMiddleware, AdmittedStreamingResponse, record_service
+
+SCOPE = {"type": "http", "asgi": {"version": "3.0", "spec_version": "2.4"}, "method": "POST", "path": "/predict/batch"}
+
+
+async def receive():
+    await asyncio.sleep(3600)
+    return {"type": "http.disconnect"}
+
+
+async def body(ticket, service=0.0, queued=0.0):
+    ticket.activate()
+    await asyncio.sleep(queued)
+    record_service(service)
+    yield b"{}\n"
+    ticket.complete()
+
+
+def test_ticket_released_when_response_start_fails():
+    admission = AdmissionController(max_queue=4)
+    ticket = admission.admit(10.0)
+
+    async def send(message):
+        raise OSError("client went away")
+
+    response = AdmittedStreamingResponse(body(ticket), ticket)
+    with pytest.raises(Exception):
+        asyncio.run(response(SCOPE, receive, send))
+    assert admission.stats()["in_flight"] == 0
+
+
+def test_ticket_released_when_response_never_runs():
+    admission = AdmissionController(max_queue=4)
+    ticket = admission.admit(10.0)
+    response = AdmittedStreamingResponse(body(ticket), ticket)
+    assert admission.stats()["in_flight"] == 1
+
+    del ticket, response
+    gc.collect()
+    assert admission.stats()["in_flight"] == 0
+    assert admission.stats()["estimated_wait_seconds"] == 0
+
+
+def test_ticket_released_once_after_stream_finishes():
+    admission = AdmissionController(max_queue=4)
+    ticket = admission.admit(10.0)
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(AdmittedStreamingResponse(body(ticket), ticket)(SCOPE, receive, send))
+    assert sent[-1] == {"type": "http.response.body", "body": b"", "more_body": False}
+    ticket.close()
+    del ticket
+    gc.collect()
+    assert admission.stats()["in_flight"] == 0
+
+
+def test_rate_learned_from_service_time_not_queueing():
+    admission = AdmissionController(max_queue=4, initial_rate=0.02)
+    ticket = admission.admit(10.0)
+
+    async def send(message):
+        pass
+
+    # 0.2s of work for 10s of audio, after 0.3s spent waiting for a worker
+    response = AdmittedStreamingResponse(body(ticket, service=0.2, queued=0.3), ticket)
+    asyncio.run(response(SCOPE, receive, send))
+    assert admission.rate == pytest.approx(0.02)
+
+
+def test_middleware_sheds_before_reading_the_body():
+    admission = AdmissionController(max_queue=1)
+    ticket = admission.admit(10.0)
+    calls = []
+
+    async def app(scope, receive, send):
+        calls.append(scope["path"])
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    middleware = AdmissionMiddleware(app, controller=admission, paths=("/predict/batch",))
+    asyncio.run(middleware(SCOPE, receive, send))
+    assert calls == []
+    assert sent[0]["status"] == 503
+    assert (b"retry-after", b"1") in sent[0]["headers"]
+
+    ticket.close()
+    asyncio.run(middleware(SCOPE, receive, send))
+    assert calls == ["/predict/batch"]
@@ -0,0 +1,56 @@
+"""
+Tests for the inference batcher: forward passes never exceed the batch limit,
+and every request gets back its own rows
+
+    python -m pytest test_batching.py
+"""
+import asyncio
+
+import numpy as np
+
+from batching import InferenceBatcher
+
+
+def test_oversized_submission_is_split_into_bounded_passes():
+    passes = []
+
+    def predict(inputs):
+        passes.append(len(inputs))
+        return inputs[:, :1] * 2
+
+    async def run():
+        batcher = InferenceBatcher(predict, max_batch_size=8, max_wait_ms=1)
+        await batcher.start()
+        try:
+            return await batcher.submit(np.arange(100, dtype=np.float32).reshape(100, 1))
+        finally:
+            await batcher.stop()
+
+    outputs = asyncio.run(run())
+    assert max(passes) <= 8
+    assert sum(passes) == 100
+    np.testing.assert_array_equal(outputs[:, 0], np.arange(100) * 2)
+
+
+def test_concurrent_submissions_get_their_own_rows():
+    passes = []
+
+    def predict(inputs):
+        passes.append(len(inputs))
+        return inputs
+
+    async def run():
+        batcher = InferenceBatcher(predict, max_batch_size=4, max_wait_ms=20)
+        await batcher.start()
+        try:
+            return await asyncio.gather(*(
+                batcher.submit(np.full((rows, 1), rows, dtype=np.float32)) for rows in (3, 5, 2)
+            ))
+        finally:
+            await batcher.stop()
+
+    results = asyncio.run(run())
+    assert max(passes) <= 4
+    for rows, outputs in zip((3, 5, 2), results):
+        assert outputs.shape == (rows, 1)
+        assert (outputs == rows).all()
@@ -0,0 +1,39 @@
+"""
+Parity of the NumPy MFCC engine with librosa.feature.mfcc, on synthetic signals
+and on any recordings listed in MFCC_PARITY_AUDIO (separated by os.pathsep)
+
+    python -m pytest test_mfcc.py
+"""
+import os
+
+import numpy as np
+import pytest
+
+import mfcc
+
+librosa = pytest.importorskip("librosa")
+
+MAX_RELATIVE_ERROR = 1e-3
+
+
+def relative_error(y: np.ndarray, sr: int) -> float:
+    expected = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=mfcc.N_MFCC)
+    actual = mfcc.mfcc(y, sr, max_frames=expected.shape[1])
+    return float(np.max(np.abs(expected - actual))) / max(float(np.max(np.abs(expected))), 1.0)
+
+
+@pytest.mark.parametrize("sr", [4000, 8000, 22050, 44100])
+def test_matches_librosa_on_synthetic_signal(sr):
+    rng = np.random.default_rng(0)
+    t = np.arange(int(sr * 3.0)) / sr
+    signal = 0.3 * np.sin(2 * np.pi * 300.0 * t) + 0.05 * rng.standard_normal(t.size)
+    assert relative_error(signal.astype(np.float32), sr) <= MAX_RELATIVE_ERROR
+
+
+@pytest.mark.parametrize("path", [p for p in os.getenv("MFCC_PARITY_AUDIO", "").split(os.pathsep) if p])
+def test_matches_librosa_on_recording(path):
+    from audio_io import decode_audio
+
+    with open(path, "rb") as f:
+        y, sr = decode_audio(f.read())
+    assert relative_error(y, sr) <= MAX_RELATIVE_ERROR